@@ -1,9 +1,17 @@
 from scipy import signal
+from scipy import ndimage
 import scipy
 import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
 import matplotlib.pyplot as plt
 import warnings
+from collections import OrderedDict
 from obspy import UTCDateTime
+from obspy.signal.trigger import trigger_onset
+try:
+    import finufft
+except ImportError:
+    finufft = None
 
 
 def nearest_powof2(number):
@@ -144,14 +152,8 @@ def array_response_wathelet(easting, northing, kmax, kstep, show_greater_thresh=
     #lambdamin = 2. * np.pi / max_wvnmbr
     #lambdamax = 2. * np.pi / min_wvnmbr
 
-    # distance between stations
-    d = np.zeros((easting.size, easting.size))
-    for i in range(easting.size):
-        for j in range(easting.size):
-            d[i,j] = np.sqrt((easting[i] - easting[j])**2 + (northing[i] - northing[j])**2)
     # resoluion limints according to Tokimatsu (1997) -> see Wathelet et al. (2008)
-    dmin = 2 * d[d>0].min()
-    dmax = 3 * d[d>0].max()
+    dmin, dmax = tokimatsu_limits(easting, northing)
 
     # plot
     fig = plt.figure(figsize=(10, 3.65))
@@ -204,6 +206,166 @@ def array_response_wathelet(easting, northing, kmax, kstep, show_greater_thresh=
 
 
 
+def tokimatsu_limits(easting, northing):
+    """
+    Resolution limits of an array in terms of wavelengths according to Tokimatsu (1997),
+    see Wathelet et al., 2008 (J.Seismol.): 2 * minimum and 3 * maximum station distance.
+    :param easting: Easting coordinates of stations (dim: [(number of arrays,) number of stations])
+    :param northing: Northing coordinates of stations (same dim as easting)
+
+    :return: minimum and maximum resolvable wavelength (floats, or arrays with dim:
+        [number of arrays] if several arrays are given)
+    """
+    easting = np.asarray(easting, dtype=float)
+    northing = np.asarray(northing, dtype=float)
+    # distance between stations
+    d = np.sqrt((easting[..., :, None] - easting[..., None, :])**2
+                + (northing[..., :, None] - northing[..., None, :])**2)
+    dmin = 2 * np.where(d > 0, d, np.inf).min(axis=(-2, -1))
+    dmax = 3 * d.max(axis=(-2, -1))
+    return dmin, dmax
+
+
+
+def array_response_batch(easting, northing, kx, ky):
+    """
+    Array response function as in array_response_wathelet (Wathelet et al., 2008, equation 3)
+    for many array geometries at once. The exponentials are separated in kx and ky, so that
+    the response of each geometry is a single matrix product.
+    :param easting: Easting coordinates of stations (dim: [number of arrays, number of stations])
+    :param northing: Northing coordinates of stations (dim: [number of arrays, number of stations])
+    :param kx, ky: wavenumbers in rad/m
+
+    :return: array responses (dim: [number of arrays, number of ky, number of kx])
+    """
+    easting = np.atleast_2d(easting)
+    northing = np.atleast_2d(northing)
+    ex = np.exp(-1j * easting[:, :, None] * kx[None, None, :])
+    ey = np.exp(-1j * northing[:, :, None] * ky[None, None, :])
+    sum_rth = np.matmul(ey.transpose(0, 2, 1), ex)
+    return abs(sum_rth) ** 2 / float(easting.shape[1]) ** 2
+
+
+
+def array_response_scores(Rth, kx, ky, thresh=0.5, lobe_fact=2.):
+    """
+    Scores of array responses as returned by array_response_batch.
+    :param Rth: array responses (dim: [number of arrays, number of ky, number of kx])
+    :param kx, ky: wavenumbers in rad/m
+    :param thresh: response threshold defining the width of the main lobe
+    :param lobe_fact: side lobes are searched beyond lobe_fact times the main lobe radius
+
+    :return: two numpy arrays:
+        kmin: radius of the main lobe, i.e. the smallest wavenumber where the response
+            drops below thresh (dim: [number of arrays])
+        sidelobe: highest response outside of the main lobe (dim: [number of arrays])
+    """
+    KX, KY = np.meshgrid(kx, ky)
+    k = np.sqrt(KX**2 + KY**2)
+    kmin = np.where(Rth < thresh, k, np.inf).min(axis=(1, 2))
+    sidelobe = np.where(k > lobe_fact * kmin[:, None, None], Rth, 0.).max(axis=(1, 2))
+    return kmin, sidelobe
+
+
+
+def optimize_array_layout(n_stats, radius, kmax, kstep, ncand=1000, niter=20, method="evolution",
+        nbest=5, wlobe=1., wside=1., wavelengths=None, nelite=None, sigma=0.1, chunk=500, seed=None):
+    """
+    Search array geometries with a good array response. Thousands of candidate geometries
+    are scored with the batched array response (see array_response_batch). The cost of a
+    geometry is
+        wlobe * kmin / kmax + wside * sidelobe (+ penalty),
+    i.e. a narrow main lobe and low side lobes are preferred (see array_response_scores).
+    If wavelengths is given, geometries whose Tokimatsu resolution limits do not cover the
+    wavelength range are penalized by the relative shortfall.
+
+    :param n_stats: number of stations
+    :param radius: stations are placed within a circle of this radius (in m)
+    :param kmax: maximum wavenumber considered (rad/m)
+    :param kstep: step in wavenumber
+    :param ncand: number of candidate geometries per iteration
+    :param niter: number of iterations
+    :param method: "random" (new random geometries in each iteration) or "evolution"
+        (the best geometries are kept and mutated by shifting stations randomly)
+    :param nbest: number of best geometries returned
+    :param wlobe: weight of the main lobe width
+    :param wside: weight of the side lobe level
+    :param wavelengths: (lambda_min, lambda_max) in m which should be resolved, or None
+    :param nelite: number of geometries kept in each iteration (evolution). Default ncand / 10
+    :param sigma: standard deviation of station shifts relative to radius (evolution).
+        Decreases linearly over the iterations.
+    :param chunk: number of geometries evaluated at once (limits memory consumption)
+    :param seed: seed of the random number generator
+
+    :return: two numpy arrays:
+        geoms: best geometries, coordinates relative to the circle center
+            (dim: [nbest, number of stations, 2])
+        scores: cost, kmin, sidelobe, Tokimatsu lambda_min and lambda_max of the best
+            geometries (dim: [nbest, 5])
+    """
+    # runtime
+    t1 = UTCDateTime()
+    rng = np.random.default_rng(seed)
+    if nelite is None:
+        nelite = max(1, ncand // 10)
+    kx = np.arange(-kmax, kmax + kstep, kstep)
+    ky = np.arange(-kmax, kmax + kstep, kstep)
+
+    def random_geoms(n):
+        r = radius * np.sqrt(rng.uniform(size=(n, n_stats)))
+        phi = rng.uniform(0, 2 * np.pi, size=(n, n_stats))
+        return np.stack((r * np.cos(phi), r * np.sin(phi)), axis=2)
+
+    def score(geoms):
+        scores = np.zeros((geoms.shape[0], 5))
+        for c in range(0, geoms.shape[0], chunk):
+            g = geoms[c: c + chunk]
+            Rth = array_response_batch(g[:, :, 0], g[:, :, 1], kx, ky)
+            kmin, sidelobe = array_response_scores(Rth, kx, ky)
+            dmin, dmax = tokimatsu_limits(g[:, :, 0], g[:, :, 1])
+            cost = wlobe * kmin / kmax + wside * sidelobe
+            if wavelengths is not None:
+                cost += np.maximum(dmin - wavelengths[0], 0) / wavelengths[0]
+                cost += np.maximum(wavelengths[1] - dmax, 0) / wavelengths[1]
+            scores[c: c + chunk] = np.column_stack((cost, kmin, sidelobe, dmin, dmax))
+        return scores
+
+    geoms = random_geoms(ncand)
+    best_geoms = np.zeros((0, n_stats, 2))
+    best_scores = np.zeros((0, 5))
+    for it in range(niter):
+        scores = score(geoms)
+        # keep best geometries found so far (each geometry only once)
+        best_geoms = np.concatenate((best_geoms, geoms))
+        best_scores = np.concatenate((best_scores, scores))
+        _, ind = np.unique(best_geoms.reshape(best_geoms.shape[0], -1), axis=0, return_index=True)
+        ind = ind[np.argsort(best_scores[ind, 0], kind="stable")][:max(nbest, nelite)]
+        best_geoms = best_geoms[ind]
+        best_scores = best_scores[ind]
+        print("iteration %i/%i: best cost %.3f" % (it + 1, niter, best_scores[0, 0]))
+
+        # new candidates
+        if method == "random":
+            geoms = random_geoms(ncand)
+        elif method == "evolution":
+            parents = best_geoms[rng.integers(0, min(nelite, best_geoms.shape[0]), ncand)]
+            step = sigma * radius * (1. - it / float(niter))
+            children = parents + rng.normal(scale=step, size=parents.shape)
+            # move stations outside of the circle back onto the circle
+            r = np.sqrt(np.sum(children**2, axis=2, keepdims=True))
+            children *= np.minimum(1., radius / np.maximum(r, np.finfo(float).tiny))
+            # elites are already contained in best_geoms
+            geoms = children
+        else:
+            raise ValueError("method must be either 'random' or 'evolution'")
+
+    # runtime
+    t2 = UTCDateTime()
+    print("runtime: %.1f s" % (t2 - t1))
+    return best_geoms[:nbest], best_scores[:nbest]
+
+
+
 def annul_dominant_interferers(CSDM, neig, data):
     """
     This routine cancels the strong interferers from the data by projecting the
@@ -345,6 +507,69 @@ def calculate_CSDM(dft_array, neig=0, norm=True):
 
 
 
+def calculate_snapshots(dft_array, neig=0, norm=True):
+    """
+    Calculate the (projected and normalized) snapshot matrix D for which D D^H equals
+    the CSDM matrix returned by calculate_CSDM. If the number of windows is smaller
+    than the number of stations, beamforming with the Bartlett processor is cheaper
+    from D (see phase_matching_snapshots) than from the CSDM matrix.
+    :param dft_array: 2-Dim array containing DFTs of all stations
+        and for multiple time windows. dim: [number stations, number windows]
+    :param neig: Number of eigenvalues to project out.
+    :param norm: If True, normalize such that D D^H is the normalized CSDM matrix.
+
+    :return: snapshot matrix (dim: [number stations, number windows])
+    """
+    D = dft_array
+    if np.linalg.matrix_rank(D) < D.shape[0]:
+        warnings.warn("Warning! Poorly conditioned cross-spectral-density matrix.")
+
+    # annul dominant source - left singular vectors of D are the eigenvectors of D D^H
+    if neig > 0:
+        u, _, _ = np.linalg.svd(D, full_matrices=False)
+        u_m = u[:, :neig]
+        D = D - np.dot(u_m, np.dot(u_m.conj().T, D))
+
+    # normalize - Frobenius norm of D D^H equals that of D^H D
+    if norm:
+        D = D / np.sqrt(np.linalg.norm(np.dot(D.conj().T, D)))
+
+    return D
+
+
+
+def csdm_coherence(K, snapshots=False):
+    """
+    Coherence of CSDM matrices, given as the ratio of the largest eigenvalue to the trace.
+    Equals 1 for a single coherent plane wave and 1 / number of stations for incoherent noise.
+    :param K: CSDM matrices (dim: [(number of frequencies,) number of stations, number of
+        stations]), or snapshot matrices (dim: [(number of frequencies,) number of stations,
+        number of shots]) if snapshots is True (see calculate_snapshots)
+    :param snapshots: if True, K holds snapshot matrices D. The non-zero eigenvalues of
+        D D^H are the ones of the (smaller) matrix D^H D.
+
+    :return: coherence (float, or array with dim: [number of frequencies])
+    """
+    if snapshots:
+        K = np.matmul(np.swapaxes(K, -1, -2).conj(), K)
+    eigvals = np.linalg.eigvalsh(K)
+    trace = np.sum(eigvals, axis=-1)
+    return eigvals[..., -1] / np.where(trace > 0, trace, np.inf)
+
+
+
+def phase_matching_snapshots(replica, D):
+    """
+    Do phase matching of the replica vector with the snapshot matrix (Bartlett
+    processor only). Equals phase_matching(replica, D D^H, "bartlett").
+    :param replica: 2-D array containing the replica vectors of all parameter
+        combinations (dim: [n_stats, n_param])
+    :param D: snapshot matrix as returned by calculate_snapshots (dim: [n_stats, n_shots])
+    """
+    return np.sum(abs(np.dot(D.conj().T, replica))**2, axis=0)
+
+
+
 def phase_matching(replica, K, processor):
     """
     Do phase matching of the replica vector with the CSDM matrix.
@@ -388,14 +613,456 @@ def phase_matching(replica, K, processor):
     
 
 
+def phase_matching_batch(replica, K, processor):
+    """
+    Do phase matching of replica vectors with a stack of CSDM matrices at once.
+    :param replica: replica vectors, either the same for all CSDMs (dim: [n_stats, n_param])
+        or one set per CSDM (dim: [n_csdm, n_stats, n_param])
+    :param K: stack of CSDM matrices (dim: [n_csdm, n_stats, n_stats])
+    :param processor: Processor used for phase matching. bartlett or adaptive.
+
+    :return: beams (dim: [n_csdm, n_param])
+    """
+    # calcualte inverses of CSDM matrices for adaptive processor
+    if processor == "adaptive":
+        K = np.linalg.inv(K)
+    if replica.ndim == 2:
+        replica = replica[None, :, :]
+    # r^H K r for all CSDMs and parameter combinations
+    dot = np.sum(replica.conj() * np.matmul(K, replica), axis=1)
+    if processor == "bartlett":
+        beam = abs(dot)
+    elif processor == "adaptive":
+        beam = abs((1. + 0.j) / dot)
+    return beam
+
+
+
+def dft_matrix(w_length, Fs, freq):
+    """
+    Construct the matrix used to calculate the DFT of a sliding window.
+    :param w_length: length of sliding window in seconds
+    :param Fs: sampling rate of data streams
+    :param freq: analysis frequencies
+
+    :return: DFT matrix (dim: [number of window samples, number of frequencies])
+    """
+    # construct time vector for sliding window
+    w_time = np.arange(0, w_length, 1./Fs)
+    return np.exp(2. * np.pi * 1j * np.dot(w_time[:, None], freq[:, None].T))
+
+
+
+def calculate_DFT(data, matrice_int, npts_delay):
+    """
+    Calculate the normalized DFTs (data steering vectors) of all stations and
+    all sliding windows ('shots'). Only the samples of the current shot are accessed
+    at a time, i.e. data can be a memory-mapped array (e.g. np.load(fn, mmap_mode="r"))
+    which is not loaded into memory as a whole.
+    :param data: time series of used stations (dim: [number of samples, number of stations]).
+        Can also be an iterator yielding consecutive chunks of the time series
+        (each dim: [number of samples in chunk, number of stations]).
+    :param matrice_int: DFT matrix as returned by dft_matrix
+    :param npts_delay: delay of sliding window in samples
+
+    :return: data steering vectors (dim: [number of frequencies, number of stations,
+        number of shots])
+    """
+    if not hasattr(data, "shape"):
+        return calculate_DFT_chunks(data, matrice_int, npts_delay)
+    npts, n_stats = data.shape
+    npts_win = matrice_int.shape[0]
+    # number of analysis windows ('shots')
+    nshots = int(np.floor((npts - npts_win) / npts_delay)) + 1
+
+    # initialize data steering vector:
+    # dim: [number of frequencies, number of stations, number of analysis windows]
+    vect_data = np.zeros((matrice_int.shape[1], n_stats, nshots), dtype=complex)
+    for n in range(nshots):
+        # calculate DFT, mean averages over time axis
+        # dim: [number stations, number frequencies]
+        data_freq = np.dot(data[n*npts_delay: n*npts_delay+npts_win].T, matrice_int) / npts_win
+        # fill data steering vector: n'th shot.
+        # normalize in order not to bias strongest seismogram.
+        vect_data[:, :, n] = (data_freq / abs(data_freq)).conj().T
+    return vect_data
+
+
+
+def calculate_DFT_chunks(chunks, matrice_int, npts_delay):
+    """
+    Same as calculate_DFT, but for time series which are streamed in consecutive chunks.
+    Only the samples of shots which are not yet completed are kept in memory.
+    :param chunks: iterator yielding consecutive chunks of the time series
+        (each dim: [number of samples in chunk, number of stations])
+    :param matrice_int: DFT matrix as returned by dft_matrix
+    :param npts_delay: delay of sliding window in samples
+
+    :return: data steering vectors (dim: [number of frequencies, number of stations,
+        number of shots])
+    """
+    npts_win = matrice_int.shape[0]
+    vect_data = []
+    buf = None
+    skip = 0
+    for chunk in chunks:
+        chunk = np.asarray(chunk, dtype=float)
+        # skip samples between end of buffer and start of next shot
+        if skip >= chunk.shape[0]:
+            skip -= chunk.shape[0]
+            continue
+        chunk = chunk[skip:]
+        skip = 0
+        buf = chunk if buf is None else np.concatenate((buf, chunk))
+        # calculate DFTs of all shots completed by this chunk
+        n = 0
+        while n + npts_win <= buf.shape[0]:
+            data_freq = np.dot(buf[n: n+npts_win].T, matrice_int) / npts_win
+            vect_data.append((data_freq / abs(data_freq)).conj().T)
+            n += npts_delay
+        # keep only samples needed for following shots
+        if n >= buf.shape[0]:
+            skip = n - buf.shape[0]
+            buf = None
+        else:
+            buf = buf[n:]
+    # dim: [number of frequencies, number of stations, number of shots]
+    return np.stack(vect_data, axis=2)
+
+
+
+def plwave_delays(scoord, teta, s):
+    """
+    Travel time delays of plane waves at the stations.
+    :param scoord: UTM coordinates of stations (dim: [number of stations, 2])
+    :param teta: propagation directions (back azimuth + 180) in degree (dim: [number of parameters])
+    :param s: slownesses in s/m (dim: [number of parameters])
+
+    :return: delays (dim: [number of stations, number of parameters])
+    """
+    return (scoord[:, 0, None] * np.cos(np.radians(90 - teta)) \
+          + scoord[:, 1, None] * np.sin(np.radians(90 - teta))) * s
+
+
+
+def replica_vector(tau, freq):
+    """
+    Calculate normalized replica vectors from travel time delays.
+    :param tau: travel time delays (dim: [number of stations, number of parameters])
+    :param freq: frequency
+
+    :return: replica vectors (dim: [number of stations, number of parameters])
+    """
+    replica = np.exp(-1j * 2. * np.pi * freq * tau)
+    replica /= np.linalg.norm(replica, axis=0)
+    return replica
+
+
+
+def band_weights(freq, fbands=None):
+    """
+    Weights used to aggregate the beams of the single analysis frequencies.
+    :param freq: analysis frequencies
+    :param fbands: None for the average over all frequencies, "all" for the beams of
+        all single frequencies, or a list of frequency bands [(f1, f2), ...] for the
+        average over the frequencies within each band.
+
+    :return: weights (dim: [number of output beams, number of frequencies])
+    """
+    if fbands is None:
+        return np.ones((1, freq.size)) / freq.size
+    if isinstance(fbands, str) and fbands == "all":
+        return np.identity(freq.size)
+    weights = np.zeros((len(fbands), freq.size))
+    for b, (f1, f2) in enumerate(fbands):
+        ind = np.where((freq >= f1 - 1.e-9) & (freq <= f2 + 1.e-9))[0]
+        if ind.size == 0:
+            raise ValueError("no analysis frequency in band %.2f - %.2f Hz" % (f1, f2))
+        weights[b, ind] = 1. / ind.size
+    return weights
+
+
+
+def evaluate_beam(tau, K, freq, processor, fbands=None, snapshots=False, replicas=None):
+    """
+    Evaluate the beam (averaged over frequencies) for given travel time delays.
+    :param tau: travel time delays (dim: [number of stations, number of parameters])
+    :param K: CSDM matrices of all frequencies (dim: [number of frequencies, number of
+        stations, number of stations]), or snapshot matrices (dim: [number of frequencies,
+        number of stations, number of shots]) if snapshots is True
+    :param freq: analysis frequencies
+    :param processor: processor used for phase matching. bartlett or adaptive. If a list
+        of processors is given, the replica vectors and CSDMs are shared and one beam per
+        processor is returned.
+    :param fbands: if given, frequency resolved beams are returned (see band_weights)
+    :param snapshots: if True, K holds snapshot matrices (see calculate_snapshots). Only
+        supported for the bartlett processor.
+    :param replicas: replica vectors of all frequencies (dim: [number of frequencies,
+        number of stations, number of parameters]). Calculated from tau if not given.
+
+    :return: beam (dim: [number of parameters]), or beams (dim: [number of processors,
+        number of parameters]) if a list of processors is given. If fbands is given,
+        an additional dimension [number of bands] precedes the parameter dimension.
+    """
+    processors = processor if isinstance(processor, (list, tuple)) else [processor]
+    weights = band_weights(freq, fbands)
+    beam = np.zeros((len(processors), weights.shape[0], tau.shape[1]))
+    for ll in range(freq.size):
+        replica = replica_vector(tau, freq[ll]) if replicas is None else replicas[ll]
+        ind = np.where(weights[:, ll] > 0)[0]
+        for i, proc in enumerate(processors):
+            if snapshots:
+                if proc != "bartlett":
+                    raise ValueError("snapshot matrices only supported for bartlett processor")
+                beam[i, ind] += weights[ind, ll, None] * phase_matching_snapshots(replica, K[ll])
+            else:
+                beam[i, ind] += weights[ind, ll, None] * phase_matching(replica, K[ll], proc)
+    if fbands is None:
+        beam = beam[:, 0]
+    if not isinstance(processor, (list, tuple)):
+        beam = beam[0]
+    return beam
+
+
+
+def refine_peak(beam, axes, circular=None, method="quadratic"):
+    """
+    Sub-grid estimate of the location of the beam maximum. Along each grid axis, a parabola
+    (method="quadratic") or a Gaussian (parabola fitted to the logarithm of the beam,
+    method="gaussian") is fitted through the grid maximum and its two neighbours.
+    :param beam: beam power (dim: [len(axes[0]), len(axes[1]), ...])
+    :param axes: list containing the grid coordinates of each beam dimension
+    :param circular: list containing the period of each axis (e.g. 360 for back azimuth)
+        or None for non-periodic axes. If None, all axes are non-periodic.
+    :param method: quadratic or gaussian
+
+    :return: list of refined coordinates (one per axis) and interpolated beam power
+    """
+    ind = np.unravel_index(np.nanargmax(beam), beam.shape)
+    if circular is None:
+        circular = [None] * beam.ndim
+    y1 = beam[ind]
+    if method == "gaussian":
+        y1 = np.log(max(y1, np.finfo(float).tiny))
+
+    peak = []
+    dval = 0.
+    for d, ax in enumerate(axes):
+        ax = np.asarray(ax, dtype=float)
+        i = ind[d]
+        x1 = ax[i]
+        n = ax.size
+        # periodic axes may contain the same point at both ends (e.g. 1 and 361 deg)
+        if circular[d] is not None and n > 2 and np.isclose(ax[-1] - ax[0], circular[d]):
+            n -= 1
+        if n < 3:
+            peak.append(x1)
+            continue
+        # neighbouring grid points
+        if circular[d] is not None:
+            i0 = (i - 1) % n
+            i2 = (i + 1) % n
+            x0 = x1 - (ax[i % n] - ax[i0]) % circular[d]
+            x2 = x1 + (ax[i2] - ax[i % n]) % circular[d]
+        else:
+            if i == 0 or i == n - 1:
+                peak.append(x1)
+                continue
+            i0 = i - 1
+            i2 = i + 1
+            x0 = ax[i0]
+            x2 = ax[i2]
+        ind_ = list(ind)
+        ind_[d] = i0
+        y0 = beam[tuple(ind_)]
+        ind_[d] = i2
+        y2 = beam[tuple(ind_)]
+        if method == "gaussian":
+            y0 = np.log(max(y0, np.finfo(float).tiny))
+            y2 = np.log(max(y2, np.finfo(float).tiny))
+
+        # vertex of parabola through the three (not necessarily equidistant) points
+        num = (x1 - x0)**2 * (y1 - y2) - (x1 - x2)**2 * (y1 - y0)
+        den = (x1 - x0) * (y1 - y2) - (x1 - x2) * (y1 - y0)
+        if den == 0:
+            peak.append(x1)
+            continue
+        xp = np.clip(x1 - 0.5 * num / den, min(x0, x2), max(x0, x2))
+        # value of parabola at vertex (Lagrange form)
+        yp = y0 * (xp - x1) * (xp - x2) / ((x0 - x1) * (x0 - x2)) \
+           + y1 * (xp - x0) * (xp - x2) / ((x1 - x0) * (x1 - x2)) \
+           + y2 * (xp - x0) * (xp - x1) / ((x2 - x0) * (x2 - x1))
+        dval += yp - y1
+        peak.append(xp)
+
+    val = y1 + dval
+    if method == "gaussian":
+        val = np.exp(val)
+    return peak, val
+
+
+
+def find_peaks(beam, axes, npeaks, circular=None, nbh=1):
+    """
+    The npeaks strongest separated maxima of a beam (e.g. of several simultaneous sources).
+    Peaks are found by a vectorised non-maximum suppression: a grid point is a peak if it
+    is the maximum within nbh grid points along each axis.
+    :param beam: beam power (dim: [len(axes[0]), len(axes[1]), ...])
+    :param axes: list containing the grid coordinates of each beam dimension
+    :param npeaks: maximum number of peaks returned
+    :param circular: list containing the period of each axis (e.g. 360 for back azimuth)
+        or None for non-periodic axes. If None, all axes are non-periodic.
+    :param nbh: half width of the suppression neighbourhood in grid points. Either one
+        value for all axes or one value per axis.
+
+    :return: peaks sorted by decreasing beam power, each given by its coordinates (one per
+        axis) and beam power (dim: [number of peaks <= npeaks, number of axes + 1])
+    """
+    if circular is None:
+        circular = [None] * beam.ndim
+    nbh = np.broadcast_to(nbh, beam.ndim)
+    axes = [np.asarray(ax, dtype=float) for ax in axes]
+    # periodic axes may contain the same point at both ends (e.g. 1 and 361 deg)
+    sl = []
+    modes = []
+    for d, ax in enumerate(axes):
+        n = ax.size
+        if circular[d] is not None and n > 2 and np.isclose(ax[-1] - ax[0], circular[d]):
+            n -= 1
+        sl.append(slice(0, n))
+        modes.append("wrap" if circular[d] is not None else "nearest")
+    b = np.where(np.isnan(beam), -np.inf, beam)[tuple(sl)]
+
+    # local maxima
+    bmax = ndimage.maximum_filter(b, size=tuple(2 * nbh + 1), mode=modes)
+    ind = np.nonzero((b == bmax) & np.isfinite(b))
+    pows = b[ind]
+    order = np.argsort(pows, kind="stable")[::-1][:npeaks]
+    return np.column_stack([axes[d][ind[d][order]] for d in range(beam.ndim)] + [pows[order]])
+
+
+
+def plwave_grid(svmin, svmax, dsv, slow, baz=None, dbaz=2):
+    """
+    Set up the back azimuth / slowness grid searched by the plane wave beamformers.
+    :param svmin, svmax: slowness/velocity interval used to calculate replica vector
+    :param dsv: slowness/velocity step used to calculate replica vector
+    :param slow: if true, svmin, svmax, dsv are slowness values. if false, velocity values
+    :param baz: Back azimuth. If given, the grid consists only of this back azimuth
+    :param dbaz: back azimuth step in degrees
+
+    :return: two numpy arrays:
+        teta: propagation direction, i.e. back azimuth + 180 (dim: [number of bazs])
+        s: slowness in s/m (dim: [number of slownesses])
+    """
+    if baz is None:
+        # integer number of steps, float steps would overshoot 361 deg
+        teta = 1 + dbaz * np.arange(int(round(360. / dbaz)) + 1) + 180
+    else:
+        teta = np.array([baz + 180])
+    if slow:
+        s = np.arange(svmin, svmax + dsv, dsv) / 1000.
+    else:
+        v = np.arange(svmin, svmax + dsv, dsv) * 1000.
+        s = 1. / v
+    return teta, s
+
+
+
+def auto_grid(scoord, fmax, svmin, svmax, slow, ovs=2.):
+    """
+    Coarsest grid resolution which still samples the main lobe of the beam adequately,
+    derived from the array aperture D and fmax. The main lobe has a width of about
+    1 / (fmax * D) in slowness and of about half the shortest wavelength in space
+    (for sources within the array). Each main lobe width is sampled by ovs grid points.
+    :param scoord: UTM coordinates of stations (dim: [number of stations, 2 or 3])
+    :param fmax: maximum frequency used for beamforming
+    :param svmin, svmax: slowness/velocity interval of the grid search
+    :param slow: if true, svmin, svmax are slowness values (s/km). if false, velocity values (km/s)
+    :param ovs: number of grid points per main lobe width
+
+    :return: three floats:
+        dsv: slowness (s/km) or velocity (km/s) step
+        dbaz: back azimuth step in degrees (360 is a multiple of it)
+        dxyz: spatial step in m (for matchedfield_beamformer)
+    """
+    xy = scoord[:, :2]
+    aperture = np.sqrt(np.sum((xy[:, None, :] - xy[None, :, :])**2, axis=2)).max()
+    # maximum slowness of the grid and slowness step in s/m
+    smax = svmax / 1000. if slow else 1. / (svmin * 1000.)
+    ds = 1. / (ovs * fmax * aperture)
+    if slow:
+        dsv = ds * 1000.
+    else:
+        # velocity step needed at the lowest velocity, in km/s
+        dsv = (svmin * 1000.)**2 * ds / 1000.
+    if svmax > svmin:
+        dsv = min(dsv, (svmax - svmin) / 2.)
+    # back azimuth step at the largest slowness
+    dbaz = 360. / np.ceil(360. / np.degrees(ds / smax))
+    # spatial step, main lobe is about half the shortest wavelength wide
+    dxyz = 1. / (2. * ovs * fmax * smax)
+    return dsv, dbaz, dxyz
+
+
+
+def plwave_setup(scoord, svmin, svmax, dsv, slow, fmin, fmax, Fs, w_length, baz=None,
+        df=0.2, dbaz=2, auto=False, replicas=False):
+    """
+    Set up everything "plwave_beamformer" needs besides the data: grid, travel time
+    delays, analysis frequencies, DFT matrix and, optionally, the replica vectors of all
+    frequencies. The setup depends only on the array and the parameters, i.e. it can be
+    reused for several time windows (see parameter setup of "plwave_beamformer").
+    See "plwave_beamformer" for the parameters.
+    :type replicas: boolean
+    :param replicas: if True, the replica vectors are calculated as well (memory:
+        number of frequencies * number of stations * number of parameters complex values)
+
+    :return: dictionary with teta (propagation direction), s (slowness in s/m), tau
+        (dim: [number of stations, number of parameters]), freq, matrice_int (see
+        dft_matrix) and replicas (dim: [number of frequencies, number of stations,
+        number of parameters], None if not calculated)
+    """
+    # grid for search over backazimuth and apparent velocity
+    teta, s = plwave_grid(svmin, svmax, dsv, slow, baz, dbaz)
+    if auto:
+        n_user = teta.size * s.size
+        dsv, dbaz, _ = auto_grid(scoord, fmax, svmin, svmax, slow)
+        teta, s = plwave_grid(svmin, svmax, dsv, slow, baz, dbaz)
+        print("[INFO] auto grid: dsv = %.4f, dbaz = %.1f deg -> %i instead of %i grid points (%i saved)"
+              % (dsv, dbaz, teta.size * s.size, n_user, n_user - teta.size * s.size))
+    # create meshgrids
+    teta_, s_ = np.meshgrid(teta, s)
+    n_param = teta_.size
+    # travel time delays of all stations for all parameter combinations
+    # dim: [number of stations, number of parameters]
+    tau = plwave_delays(scoord, teta_.reshape(n_param), s_.reshape(n_param))
+
+    # construct analysis frequencies
+    freq = np.arange(fmin, fmax+df, df)
+    # construct matrix for DFT calculation
+    # dim: [number time points, number frequencies]
+    matrice_int = dft_matrix(w_length, Fs, freq)
+    if replicas:
+        replicas = np.array([replica_vector(tau, f) for f in freq])
+    else:
+        replicas = None
+    return {"teta": teta, "s": s, "tau": tau, "freq": freq, "matrice_int": matrice_int,
+            "replicas": replicas}
+
+
+
 def plwave_beamformer(data, scoord, svmin, svmax, dsv, slow, fmin, fmax, Fs, w_length,
-        w_delay, baz=None, processor="bartlett", df=0.2, neig=0, norm=True):
+        w_delay, baz=None, processor="bartlett", df=0.2, neig=0, norm=True, refine=None,
+        fbands=None, fselect=None, npeaks=None, dbaz=2, auto=False, nbh=1, setup=None):
     """
     This routine estimates the back azimuth and phase velocity of incoming waves
     based on the algorithm presented in Corciulo et al., 2012 (in Geophysics).
 
     :type data: numpy.ndarray
-    :param matr: time series of used stations (dim: [number of samples, number of stations])
+    :param matr: time series of used stations (dim: [number of samples, number of stations]).
+        Can be a memory-mapped array or an iterator yielding consecutive chunks of the
+        time series (see calculate_DFT).
     :type scoord: numpy.ndarray
     :param scoord: UTM coordinates of stations (dim: [number of stations, 2])
     :type svmin, svmax: float
@@ -414,9 +1081,11 @@ def plwave_beamformer(data, scoord, svmin, svmax, dsv, slow, fmin, fmax, Fs, w_l
     :param w_delay: delay of sliding window in seconds with respect to previous window
     :type baz: float
     :param baz: Back azimuth. If given, the beam is calculated only for this specific back azimuth
-    :type processor: string
+    :type processor: string or list
     :param processor: processor used to match the cross-spectral-density matrix to the
-        replica vecotr. see Corciulo et al., 2012
+        replica vecotr. see Corciulo et al., 2012. If a list of processors is given
+        (e.g. ["bartlett", "adaptive"]), one beam per processor is calculated in a
+        single pass.
     :type df: float
     :param df: frequency step between fmin and fmax
     :type neig: integer
@@ -424,130 +1093,638 @@ def plwave_beamformer(data, scoord, svmin, svmax, dsv, slow, fmin, fmax, Fs, w_l
         enables to suppress strong sources.
     :type norm: boolean
     :param norm: if True (default), beam power is normalized
+    :type refine: string
+    :param refine: if "quadratic" or "gaussian", the location of the beam maximum is
+        refined below the grid resolution (see refine_peak) and the beam is evaluated
+        at the refined location.
+    :type fbands: string or list
+    :param fbands: if "all", the beams of all single analysis frequencies are returned
+        instead of their average (e.g. for dispersion analysis). If a list of frequency
+        bands [(f1, f2), ...] is given, the beams averaged within each band are returned.
+        If refine is given, the maximum of the average over all returned beams is refined.
+    :type fselect: int or float
+    :param fselect: if given, phase matching is done only for the most coherent frequencies
+        (see csdm_coherence): for an integer, the fselect most coherent frequencies are used,
+        for a float, the frequencies with a coherence of at least fselect. Not supported
+        together with fbands.
+    :type npeaks: int
+    :param npeaks: if given, the npeaks strongest separated maxima of the beam are
+        returned (see find_peaks), e.g. for several simultaneous sources.
+    :type dbaz: float
+    :param dbaz: back azimuth step in degrees
+    :type auto: boolean
+    :param auto: if True, dsv and dbaz are replaced by the coarsest steps which still
+        sample the main lobe adequately (see auto_grid).
+    :type nbh: int or tuple
+    :param nbh: minimum separation of the maxima returned for npeaks in grid points
+        (slowness, baz), see find_peaks
+    :type setup: dict
+    :param setup: precomputed setup as returned by plwave_setup (e.g. shared by several
+        time windows of the array). If given, the grid and frequency parameters are ignored.
 
     :return: three numpy arrays:
         teta: back azimuth (dim: [number of bazs, 1])
         c: phase velocity (dim: [number of cs, 1])
         beamformer (dim: [number of bazs, number of cs])
+        if fbands is given, beamformer has the dimension [number of frequencies or
+        number of bands, number of cs, number of bazs].
+        if refine is given, additionally a tuple (baz, slowness, beam power) of the
+        refined maximum.
+        if npeaks is given, additionally an array containing baz, slowness and beam power
+        of the strongest maxima (dim: [number of peaks, 3]).
+        if fselect is given, additionally the selected frequencies.
+        if a list of processors is given, beamformer (and the refined maximum) are
+        lists with one entry per processor.
     """
 
-    # number of stations
-    n_stats = data.shape[1]
+    # grid, travel time delays, analysis frequencies and DFT matrix
+    if setup is None:
+        setup = plwave_setup(scoord, svmin, svmax, dsv, slow, fmin, fmax, Fs, w_length, baz,
+                             df, dbaz, auto)
+    teta = setup["teta"].copy()
+    s, tau, freq, replicas = setup["s"], setup["tau"], setup["freq"], setup["replicas"]
+    # calculate DFTs, dim: [number of frequencies, number of stations, number of shots]
+    vect_data = calculate_DFT(data, setup["matrice_int"], int(w_delay * Fs))
+
+    # calculate cross-spectral density matrices, dim: [number of frequencies, number of
+    # stations, number of stations]. For the bartlett processor and less shots than
+    # stations, the (projected) snapshot matrices are cheaper to use (also the projection
+    # of neig eigenvectors), dim: [number of frequencies, number of stations, number of shots]
+    processors = processor if isinstance(processor, (list, tuple)) else [processor]
+    snapshots = all(proc == "bartlett" for proc in processors) \
+        and vect_data.shape[2] < vect_data.shape[1]
+    csdm = calculate_snapshots if snapshots else calculate_CSDM
+    K = np.array([csdm(vect_data[ll,:,:], neig, norm) for ll in range(freq.size)])
+
+    # select most coherent frequencies
+    if fselect is not None:
+        if fbands is not None:
+            raise ValueError("fselect is not supported together with fbands")
+        coh = csdm_coherence(K, snapshots)
+        if isinstance(fselect, (int, np.integer)):
+            ind = np.sort(np.argsort(coh)[::-1][:fselect])
+        else:
+            ind = np.where(coh >= fselect)[0]
+            if ind.size == 0:
+                warnings.warn("No frequency with coherence >= %.2f, most coherent one used." % fselect)
+                ind = np.array([np.argmax(coh)])
+        freq = freq[ind]
+        K = K[ind]
+        if replicas is not None:
+            replicas = replicas[ind]
+
+    # do phase matching and average over frequencies
+    # dim: [number of processors, n_param]
+    beamformer = evaluate_beam(tau, K, freq, processors, fbands, snapshots, replicas)
+    # reshape, dim: [number of processors, (number of bands,) number baz, number slowness]
+    beamformer = np.reshape(beamformer, beamformer.shape[:-1] + (s.size, teta.size))
+
+    # refine maximum and evaluate beam at refined location
+    if refine is not None:
+        peak = []
+        for i, proc in enumerate(processors):
+            beam = beamformer[i] if fbands is None else np.mean(beamformer[i], axis=0)
+            (s_max, teta_max), _ = refine_peak(beam, [s, teta], [None, 360.], refine)
+            tau_max = plwave_delays(scoord, np.array([teta_max]), np.array([s_max]))
+            pow_max = evaluate_beam(tau_max, K, freq, proc, fbands, snapshots)
+            pow_max = pow_max[0] if fbands is None else np.mean(pow_max)
+            peak.append(((teta_max - 180) % 360, s_max*1000., pow_max))
+
+    # strongest separated maxima
+    if npeaks is not None:
+        peaks = []
+        for i in range(len(processors)):
+            beam = beamformer[i] if fbands is None else np.mean(beamformer[i], axis=0)
+            pks = find_peaks(beam, [s, teta], npeaks, [None, 360.], nbh)
+            peaks.append(np.column_stack(((pks[:, 1] - 180) % 360, pks[:, 0]*1000., pks[:, 2])))
 
-    # grid for search over backazimuth and apparent velocity
-    if baz is None:
-        teta = np.arange(1, 363, 2) + 180
-    else:
-        teta = np.array([baz + 180])
-    if slow:
-        s = np.arange(svmin, svmax + dsv, dsv) / 1000.
+    teta -= 180
+    if isinstance(processor, (list, tuple)):
+        beamformer = list(beamformer)
     else:
-        v = np.arange(svmin, svmax + dsv, dsv) * 1000.
-        s = 1. / v
+        beamformer = beamformer[0]
+        if refine is not None:
+            peak = peak[0]
+        if npeaks is not None:
+            peaks = peaks[0]
+    res = (teta, s*1000., beamformer)
+    if refine is not None:
+        res += (peak,)
+    if npeaks is not None:
+        res += (peaks,)
+    if fselect is not None:
+        res += (freq,)
+    return res
 
-    # create meshgrids
+
+def calculate_CSDM_ccf(ccfs, pairs, n_stats, Fs, freq, neig=0, norm=True):
+    """
+    Calculate CSDM matrices directly from (stacked) inter-station cross-correlation functions,
+    e.g. as computed by myCorr (msnoise_move2obspy) from whitened data. The CSDM element
+    K_ij is the complex conjugate of the Fourier transform of the cross-correlation of
+    stations i and j. If no autocorrelations are given, the diagonal of K is zero
+    (cross-correlation beamforming, see Ruigrok et al., 2017).
+    :param ccfs: cross-correlation functions for lags -maxlag to maxlag
+        (dim: [number of pairs, 2 * maxlag + 1])
+    :param pairs: station indices (i, j) of the cross-correlation functions, where i is
+        correlated with j as data[0] with data[1] in myCorr. (i, i) for autocorrelations.
+        (dim: [number of pairs, 2])
+    :param n_stats: number of stations
+    :param Fs: sampling rate of the cross-correlation functions
+    :param freq: analysis frequencies
+    :param neig: Number of eigenvalues to project out.
+    :param norm: If True, normalize CSDM matrices.
+
+    :return: CSDM matrices (dim: [number of frequencies, number of stations, number of stations])
+    """
+    ccfs = np.atleast_2d(ccfs)
+    pairs = np.atleast_2d(pairs).astype(int)
+    maxlag = (ccfs.shape[1] - 1) // 2
+    # Fourier transform of the cross-correlation functions at the analysis frequencies
+    lags = (np.arange(ccfs.shape[1]) - maxlag) / Fs
+    spec = np.dot(ccfs, np.exp(-2. * np.pi * 1j * np.dot(lags[:, None], freq[None, :])))
+
+    K = np.zeros((freq.size, n_stats, n_stats), dtype=complex)
+    K[:, pairs[:, 0], pairs[:, 1]] = spec.conj().T
+    K[:, pairs[:, 1], pairs[:, 0]] = spec.T
+    # autocorrelations are real
+    auto = pairs[:, 0] == pairs[:, 1]
+    K[:, pairs[auto, 0], pairs[auto, 0]] = abs(spec[auto].T)
+
+    for ll in range(freq.size):
+        # annul dominant source by projecting the strongest eigenvectors out of K
+        if neig > 0:
+            u, _, _ = np.linalg.svd(K[ll])
+            proj = np.identity(n_stats) - np.dot(u[:, :neig], u[:, :neig].conj().T)
+            K[ll] = np.dot(proj, np.dot(K[ll], proj))
+        # normalize
+        if norm:
+            K[ll] /= np.linalg.norm(K[ll])
+
+    return K
+
+
+
+def plwave_beamformer_ccf(ccfs, pairs, scoord, svmin, svmax, dsv, slow, fmin, fmax, Fs,
+        baz=None, processor="bartlett", df=0.2, neig=0, norm=True):
+    """
+    Plane wave beamformer using CSDM matrices calculated from stacked cross-correlation
+    functions (see calculate_CSDM_ccf), e.g. for long-term monitoring of ambient noise
+    sources. One CSDM per frequency is needed instead of the DFTs of many windows.
+
+    :type ccfs: numpy.ndarray
+    :param ccfs: cross-correlation functions for lags -maxlag to maxlag
+        (dim: [number of pairs, 2 * maxlag + 1])
+    :type pairs: numpy.ndarray
+    :param pairs: station indices (i, j) of the cross-correlation functions
+        (dim: [number of pairs, 2]), see calculate_CSDM_ccf
+    :type Fs: float
+    :param Fs: sampling rate of the cross-correlation functions
+    :type processor: string
+    :param processor: processor used for phase matching. bartlett or adaptive. The adaptive
+        processor requires the autocorrelations.
+    See "plwave_beamformer" for all other parameters.
+
+    :return: three numpy arrays:
+        teta: back azimuth (dim: [number of bazs])
+        s: slowness (dim: [number of ss])
+        beamformer (dim: [number of ss, number of bazs])
+    """
+    n_stats = scoord.shape[0]
+    pairs = np.atleast_2d(pairs).astype(int)
+    if processor == "adaptive" and np.sum(pairs[:, 0] == pairs[:, 1]) < n_stats:
+        raise ValueError("adaptive processor requires the autocorrelations of all stations")
+
+    # grid for search over backazimuth and apparent velocity
+    teta, s = plwave_grid(svmin, svmax, dsv, slow, baz)
     teta_, s_ = np.meshgrid(teta, s)
-    n_param = teta_.size
-    # reshape
-    teta_ = teta_.reshape(n_param)
-    s_ = s_.reshape(n_param)
-    # reshape for efficient calculation
-    xscoord = np.tile(scoord[:,0].reshape(n_stats, 1), (1, n_param)) 
-    yscoord = np.tile(scoord[:,1].reshape(n_stats, 1), (1, n_param))
-    teta_ = np.tile(teta_, (n_stats, 1))
-    s_ = np.tile(s_, (n_stats, 1))
+    tau = plwave_delays(scoord, teta_.ravel(), s_.ravel())
 
-    # extract number of data points
-    npts = data[:, 1].size
     # construct analysis frequencies
     freq = np.arange(fmin, fmax+df, df)
-    # construct time vector for sliding window 
-    w_time = np.arange(0, w_length, 1./Fs)
-    npts_win = w_time.size
-    npts_delay = int(w_delay * Fs)
-    # number of analysis windows ('shots')
-    nshots = int(np.floor((npts - w_time.size) / npts_delay)) + 1
+    # CSDMs, dim: [number of frequencies, number of stations, number of stations]
+    K = calculate_CSDM_ccf(ccfs, pairs, n_stats, Fs, freq, neig, norm)
 
-    # initialize data steering vector:
-    # dim: [number of frequencies, number of stations, number of analysis windows]
-    vect_data = np.zeros((freq.size, n_stats, nshots), dtype=np.complex)
-    
-    # construct matrix for DFT calculation
-    # dim: [number time points, number frequencies]
-    matrice_int = np.exp(2. * np.pi * 1j * np.dot(w_time[:, None], freq[:, None].T))
+    # do phase matching and average over frequencies
+    beamformer = evaluate_beam(tau, K, freq, processor).reshape(s.size, teta.size)
 
-    # initialize beamformer
-    # dim: [n_param]
-    beamformer = np.zeros(n_param)
+    teta -= 180
+    return teta, s*1000., beamformer
 
-    # calculate DFTs
-    for ii in range(n_stats):
-        toto = data[:, ii]
-        # now loop over shots
-        n = 0
-        while (n * npts_delay + npts_win) <= npts:
-            # calculate DFT
-            # dim: [number frequencies]
-            adjust = np.dot(toto[n*npts_delay: n*npts_delay+npts_win][:,None],
-                     np.ones((1, len(freq))))
-            # mean averages over time axis
-            data_freq = np.mean(np.multiply(adjust, matrice_int), axis=0)
-            # fill data steering vector: ii'th station, n'th shot.
-            # normalize in order not to bias strongest seismogram.
-            # dim: [number frequencies, number stations, number shots]
-            vect_data[:, ii, n] = (data_freq / abs(data_freq)).conj().T
-            n += 1
 
-    # loop over frequencies and do phase matching
-    for ll in range(len(freq)):
-        # calculate cross-spectral density matrix
-        # dim: [number of stations X number of stations]
-        K = calculate_CSDM(vect_data[ll,:,:], neig, norm)
 
-        # calculate replica vector
-        replica = np.exp(-1j * (xscoord * np.cos(np.radians(90 - teta_)) \
-                              + yscoord * np.sin(np.radians(90 - teta_))) \
-                              * 2. * np.pi * freq[ll] * s_)
-        replica /= np.linalg.norm(replica, axis=0)
-        replica = np.reshape(replica, (n_stats, n_param))
+def plwave_beamformer_batch(data, scoord, svmin, svmax, dsv, slow, fmin, fmax, Fs, w_length,
+        w_delay, baz=None, processor="bartlett", df=0.2, neig=0, norm=True, refine=None):
+    """
+    Batched version of "plwave_beamformer" for a list of event windows recorded by the
+    same array. The grid, the replica vectors and the DFT matrix are set up only once:
+    the DFT matrix is calculated for the longest window, shorter windows use its first
+    rows (which is exact), replica vectors are shared by all windows.
+    Events which cannot be beamformed (e.g. windows too short for the given window
+    delay) are skipped with a warning, their beams (and refined maxima) are nan.
+
+    :type data: list
+    :param data: list of time series matrices of the events
+        (each dim: [number of samples, number of stations])
+    :type w_length: float or list
+    :param w_length: length of sliding window in seconds. Either one value for all events
+        or one value per event.
+    :type w_delay: float or list
+    :param w_delay: delay of sliding window in seconds. Either one value for all events
+        or one value per event.
+    See "plwave_beamformer" for all other parameters.
 
-        # do phase matching
-        beamformer += phase_matching(replica, K, processor)
+    :return: three numpy arrays:
+        teta: back azimuth (dim: [number of bazs, 1])
+        s: slowness (dim: [number of ss, 1])
+        beams (dim: [number of events, number of ss, number of bazs])
+        if refine is given, additionally an array holding baz, slowness and beam power
+        of the refined maxima (dim: [number of events, 3])
+        if a list of processors is given, beams (and the refined maxima) are lists with
+        one entry per processor.
+    """
+
+    n_ev = len(data)
+    w_length = np.broadcast_to(w_length, n_ev)
+    w_delay = np.broadcast_to(w_delay, n_ev)
+
+    # grid for search over backazimuth and apparent velocity
+    teta, s = plwave_grid(svmin, svmax, dsv, slow, baz)
+    teta_, s_ = np.meshgrid(teta, s)
+    n_param = teta_.size
+    # dim: [number of stations, number of parameters]
+    tau = plwave_delays(scoord, teta_.reshape(n_param), s_.reshape(n_param))
+    # construct analysis frequencies
+    freq = np.arange(fmin, fmax+df, df)
+
+    # calculate DFTs and cross-spectral density matrices of all events, one DFT matrix
+    # for the longest window
+    # dim of K[i]: [number of frequencies, number of stations, number of stations]
+    matrice_int = dft_matrix(np.max(w_length), Fs, freq)
+    K = [None] * n_ev
+    for i in range(n_ev):
+        npts_win = np.arange(0, w_length[i], 1./Fs).size
+        try:
+            vect_data = calculate_DFT(data[i], matrice_int[:npts_win], int(w_delay[i] * Fs))
+            K[i] = np.array([calculate_CSDM(vect_data[ll,:,:], neig, norm) for ll in range(freq.size)])
+        except Exception as e:
+            warnings.warn("event %i not beamformed (%s: %s)" % (i, type(e).__name__, e))
+    valid = [i for i in range(n_ev) if K[i] is not None]
+
+    # loop over frequencies and do phase matching for all events and processors
+    processors = processor if isinstance(processor, (list, tuple)) else [processor]
+    beams = np.full((len(processors), n_ev, n_param), np.nan)
+    beams[:, valid] = 0.
+    for ll in range(freq.size):
+        replica = replica_vector(tau, freq[ll])
+        for i in valid:
+            for j, proc in enumerate(processors):
+                beams[j, i] += phase_matching(replica, K[i][ll], proc)
+
+    # normalize and reshape, dim: [number processors, number events, number slowness, number baz]
+    beams /= freq.size
+    beams = np.reshape(beams, (len(processors), n_ev, s.size, teta.size))
+
+    # refine maxima and evaluate beams at refined locations
+    if refine is not None:
+        peaks = np.full((len(processors), n_ev, 3), np.nan)
+        for j, proc in enumerate(processors):
+            for i in valid:
+                (s_max, teta_max), _ = refine_peak(beams[j, i], [s, teta], [None, 360.], refine)
+                tau_max = plwave_delays(scoord, np.array([teta_max]), np.array([s_max]))
+                peaks[j, i] = (teta_max - 180) % 360, s_max*1000., \
+                    evaluate_beam(tau_max, K[i], freq, proc)[0]
 
-    # normalize by deviding through number of discrete frequencies
-    beamformer /= freq.size
-    # reshape, dim: [number baz, number slowness]
-    beamformer = np.reshape(beamformer, (s.size, teta.size))
     teta -= 180
-    return teta, s*1000., beamformer
+    if isinstance(processor, (list, tuple)):
+        beams = list(beams)
+        if refine is not None:
+            peaks = list(peaks)
+    else:
+        beams = beams[0]
+        if refine is not None:
+            peaks = peaks[0]
+    if refine is not None:
+        return teta, s*1000., beams, peaks
+    return teta, s*1000., beams
 
 
-def matchedfield_beamformer(data, scoord, xrng, yrng, zrng, dx, dy, dz, svrng, ds,
-        slow, fmin, fmax, Fs, w_length, w_delay,  processor="bartlett", df=0.2,
+def beam_tracking(data, tau, shape, order, circular, freq, Fs, t_win, t_step, w_length,
+        w_delay, processor="bartlett", neig=0, norm=True, nbh=2, full_every=10, pow_drop=0.8,
+        coh_min=None):
+    """
+    Beamforming of consecutive time windows with local tracking of the beam maximum. A full
+    grid search is done only for the first window, every full_every windows, if the beam
+    power drops below pow_drop times the power of the last full search, or if the maximum
+    leaves the evaluated neighbourhood. Otherwise, the beam is only evaluated in a small
+    neighbourhood around the maximum of the previous window.
+    If coh_min is given, windows whose CSDM coherence (see csdm_coherence, averaged over
+    frequencies) is below coh_min are not beamformed at all (no coherent arrival).
+    Core routine of "plwave_beamformer_track" and "matchedfield_beamformer_track".
+
+    :param data: time series of used stations (dim: [number of samples, number of stations])
+    :param tau: travel time delays of the (flattened) grid (dim: [number of stations,
+        number of parameters])
+    :param shape: shape of the beam
+    :param order: order used to reshape the flattened grid to shape ("C" or "F")
+    :param circular: list of booleans, True for periodic axes of the beam
+    :param freq: analysis frequencies
+    :param Fs: sampling rate of data streams
+    :param t_win: length of the consecutive time windows in seconds
+    :param t_step: step between consecutive time windows in seconds
+    :param w_length: length of sliding window (within time window) in seconds
+    :param w_delay: delay of sliding window in seconds with respect to previous window
+    :param processor: processor used for phase matching. bartlett or adaptive.
+    :param neig: number of dominant CSDM eigenvectors to annul from the data.
+    :param norm: if True (default), beam power is normalized
+    :param nbh: half width of the neighbourhood in grid points. Either one value for
+        all axes or one value per axis.
+    :param full_every: a full grid search is done at least every full_every windows
+    :param pow_drop: a full grid search is done if the beam power drops below pow_drop
+        times the beam power of the last full grid search
+    :param coh_min: minimum coherence of a window to be beamformed
+
+    :return:
+        times: start times of the time windows in seconds (dim: [number of windows])
+        beams: list of beams (dim: shape), np.nan where not evaluated. None for windows
+            without coherent arrival.
+        full: True for windows for which a full grid search was done (dim: [number of windows])
+    """
+    nbh = np.broadcast_to(nbh, len(shape))
+    npts_twin = int(t_win * Fs)
+    npts_tstep = int(t_step * Fs)
+    nwin = (data.shape[0] - npts_twin) // npts_tstep + 1
+    times = np.arange(nwin) * npts_tstep / Fs
+
+    # DFT matrix is the same for all windows
+    matrice_int = dft_matrix(w_length, Fs, freq)
+
+    beams = [None] * nwin
+    full = np.zeros(nwin, dtype=bool)
+    ind_max = None
+    for w in range(nwin):
+        vect_data = calculate_DFT(data[w*npts_tstep: w*npts_tstep+npts_twin], matrice_int,
+                                  int(w_delay * Fs))
+        K = np.array([calculate_CSDM(vect_data[ll,:,:], neig, norm) for ll in range(freq.size)])
+
+        # skip incoherent windows, next coherent window starts with a full grid search
+        if coh_min is not None and np.mean(csdm_coherence(K)) < coh_min:
+            ind_max = None
+            continue
+
+        # evaluate beam in neighbourhood of previous maximum
+        if ind_max is not None and w - ind_full < full_every:
+            rngs = []
+            for d, n in enumerate(shape):
+                if 2 * nbh[d] + 1 >= n:
+                    rngs.append(np.arange(n))
+                    continue
+                rng = np.arange(ind_max[d] - nbh[d], ind_max[d] + nbh[d] + 1)
+                if circular[d]:
+                    rng %= n
+                else:
+                    rng = rng[(rng >= 0) & (rng < n)]
+                rngs.append(rng)
+            sub = np.meshgrid(*rngs, indexing="ij")
+            ind_param = np.ravel_multi_index([g.ravel() for g in sub], shape, order=order)
+            beam = evaluate_beam(tau[:, ind_param], K, freq, processor).reshape(sub[0].shape)
+            loc = np.unravel_index(np.argmax(beam), beam.shape)
+            # test if maximum is located on the border of the neighbourhood
+            moved = False
+            for d, n in enumerate(shape):
+                if rngs[d].size == n:
+                    continue
+                if circular[d]:
+                    moved |= loc[d] in (0, rngs[d].size - 1)
+                else:
+                    moved |= (loc[d] == 0 and rngs[d][0] > 0) \
+                           or (loc[d] == rngs[d].size - 1 and rngs[d][-1] < n - 1)
+            if not moved and beam[loc] >= pow_drop * pow_full:
+                beams[w] = np.zeros(shape) * np.nan
+                beams[w][tuple(sub)] = beam
+                ind_max = tuple(g[loc] for g in sub)
+                continue
+
+        # full grid search
+        beam = evaluate_beam(tau, K, freq, processor).reshape(shape, order=order)
+        beams[w] = beam
+        ind_max = np.unravel_index(np.argmax(beam), beam.shape)
+        pow_full = beam[ind_max]
+        ind_full = w
+        full[w] = True
+
+    return times, beams, full
+
+
+def plwave_beamformer_track(data, scoord, svmin, svmax, dsv, slow, fmin, fmax, Fs, t_win,
+        t_step, w_length, w_delay, processor="bartlett", df=0.2, neig=0, norm=True, nbh=2,
+        full_every=10, pow_drop=0.8, coh_min=None):
+    """
+    Plane wave beamforming of consecutive time windows of continuous data (e.g. tremor).
+    The beam maximum is tracked from window to window such that most windows require
+    only the evaluation of a small neighbourhood of the grid (see "beam_tracking").
+
+    :type t_win: float
+    :param t_win: length of the consecutive time windows in seconds
+    :type t_step: float
+    :param t_step: step between consecutive time windows in seconds
+    :type nbh: int or tuple
+    :param nbh: half width of the neighbourhood in grid points (slowness, baz)
+    :type full_every: int
+    :param full_every: a full grid search is done at least every full_every windows
+    :type pow_drop: float
+    :param pow_drop: a full grid search is done if the beam power drops below pow_drop
+        times the beam power of the last full grid search
+    :type coh_min: float
+    :param coh_min: if given, windows with a CSDM coherence below coh_min are not beamformed
+        (see "beam_tracking")
+    See "plwave_beamformer" for all other parameters.
+
+    :return: six arrays:
+        teta: back azimuth (dim: [number of bazs])
+        s: slowness (dim: [number of ss])
+        times: start times of the time windows in seconds (dim: [number of windows])
+        beams: list of beams, np.nan where not evaluated (dim: [number of ss, number of
+            bazs]). None for windows without coherent arrival.
+        peaks: baz, slowness and beam power of the maxima, np.nan for windows without
+            coherent arrival (dim: [number of windows, 3])
+        full: True for windows for which a full grid search was done
+    """
+    # grid for search over backazimuth and apparent velocity
+    teta, s = plwave_grid(svmin, svmax, dsv, slow)
+    teta_, s_ = np.meshgrid(teta, s)
+    tau = plwave_delays(scoord, teta_.ravel(), s_.ravel())
+    # construct analysis frequencies
+    freq = np.arange(fmin, fmax+df, df)
+
+    times, beams, full = beam_tracking(data, tau, (s.size, teta.size), "C", [False, True], freq,
+                                       Fs, t_win, t_step, w_length, w_delay, processor, neig,
+                                       norm, nbh, full_every, pow_drop, coh_min)
+
+    # parameters of beam maxima
+    teta -= 180
+    peaks = np.zeros((times.size, 3)) * np.nan
+    for w in range(times.size):
+        if beams[w] is None:
+            continue
+        ind = np.unravel_index(np.nanargmax(beams[w]), beams[w].shape)
+        peaks[w] = teta[ind[1]], s[ind[0]]*1000., beams[w][ind]
+    return teta, s*1000., times, beams, peaks, full
+
+
+def plwave_beam_uncertainty(data, scoord, svmin, svmax, dsv, slow, fmin, fmax, Fs, w_length,
+        w_delay, method="jackknife", nboot=100, processor="bartlett", df=0.2, neig=0,
+        norm=True, refine=None, seed=None):
+    """
+    Estimate the uncertainty of back azimuth and slowness of the plane wave beamformer by
+    resampling. The DFTs are calculated only once. The CSDMs of the resamples are obtained
+    by slicing the data steering vectors (jackknife: leave one station out) or by
+    reweighting the shots (bootstrap: resample shots with replacement) and all resamples
+    are phase matched at once.
+
+    :type method: string
+    :param method: jackknife or bootstrap
+    :type nboot: int
+    :param nboot: number of bootstrap resamples
+    :type refine: string
+    :param refine: if "quadratic" or "gaussian", the maxima of the resampled beams are
+        refined below the grid resolution (see refine_peak).
+    :type seed: int
+    :param seed: seed of the random number generator used for bootstrapping
+    See "plwave_beamformer" for all other parameters.
+
+    :return: four numpy arrays:
+        teta: back azimuth (dim: [number of bazs])
+        s: slowness (dim: [number of ss])
+        beamformer: beam of all data (dim: [number of ss, number of bazs])
+        peaks: baz, slowness and beam power of the maxima of the resampled beams
+            (dim: [number of resamples, 3])
+    """
+    n_stats = data.shape[1]
+
+    # grid for search over backazimuth and apparent velocity
+    teta, s = plwave_grid(svmin, svmax, dsv, slow)
+    teta_, s_ = np.meshgrid(teta, s)
+    tau = plwave_delays(scoord, teta_.ravel(), s_.ravel())
+
+    # construct analysis frequencies and calculate DFTs once
+    freq = np.arange(fmin, fmax+df, df)
+    vect_data = calculate_DFT(data, dft_matrix(w_length, Fs, freq), int(w_delay * Fs))
+    nshots = vect_data.shape[2]
+
+    # resamples: stations kept (jackknife) or shot weights (bootstrap)
+    if method == "jackknife":
+        keep = np.array([np.delete(np.arange(n_stats), i) for i in range(n_stats)])
+        nres = n_stats
+    elif method == "bootstrap":
+        rng = np.random.default_rng(seed)
+        weights = rng.multinomial(nshots, np.ones(nshots) / nshots, size=nboot)
+        nres = nboot
+    else:
+        raise ValueError("method must be jackknife or bootstrap")
+
+    # loop over frequencies, phase matching of all data and all resamples
+    beamformer = np.zeros(teta_.size)
+    beams = np.zeros((nres, teta_.size))
+    for ll in range(freq.size):
+        replica = replica_vector(tau, freq[ll])
+        beamformer += phase_matching(replica, calculate_CSDM(vect_data[ll], neig, norm), processor)
+        if method == "jackknife":
+            K = np.array([calculate_CSDM(vect_data[ll][keep[i]], neig, norm) for i in range(nres)])
+            replica = replica[keep]
+            replica /= np.linalg.norm(replica, axis=1)[:, None, :]
+        else:
+            K = np.array([calculate_CSDM(vect_data[ll] * np.sqrt(weights[i]), neig, norm)
+                          for i in range(nres)])
+        beams += phase_matching_batch(replica, K, processor)
+    beamformer = np.reshape(beamformer / freq.size, (s.size, teta.size))
+    beams = np.reshape(beams / freq.size, (nres, s.size, teta.size))
+
+    # parameters of the maxima of the resampled beams
+    teta -= 180
+    peaks = np.zeros((nres, 3))
+    for i in range(nres):
+        if refine is not None:
+            (s_max, teta_max), pow_max = refine_peak(beams[i], [s, teta], [None, 360.], refine)
+            peaks[i] = teta_max % 360, s_max*1000., pow_max
+        else:
+            ind = np.unravel_index(np.argmax(beams[i]), beams[i].shape)
+            peaks[i] = teta[ind[1]], s[ind[0]]*1000., beams[i][ind]
+    return teta, s*1000., beamformer, peaks
+
+
+def sxsy_grid(smax, ds):
+    """
+    Set up the Cartesian slowness grid searched by plwave_beamformer_sxsy.
+    :param smax: maximum slowness in s/km. Both slowness components range from -smax to smax
+    :param ds: slowness step in s/km
+
+    :return: slowness components in s/m (dim: [number of slownesses])
+    """
+    return np.arange(-smax, smax + ds / 2., ds) / 1000.
+
+
+
+def sxsy_beam(K, scoord, freq, sx, sy):
+    """
+    Bartlett beam on a Cartesian slowness grid. The beam r^H K r is a sum over the station
+    pairs (the co-array) of K_ij * exp(i 2 pi f ((x_i - x_j) sx + (y_i - y_j) sy)). As sx
+    and sy are uniform, this is a type-1 non-uniform FFT with the co-array as non-uniform
+    points, which is used if finufft is installed and the problem is large. Otherwise, the
+    exponentials are separated in sx and sy and the sum is evaluated as one matrix product
+    (with a warning if the problem is large, as finufft is an optional dependency).
+    :param K: CSDM matrix (dim: [number of stations, number of stations])
+    :param scoord: UTM coordinates of stations (dim: [number of stations, 2])
+    :param freq: frequency
+    :param sx, sy: uniform slowness grids in s/m in x (east) and y (north) direction.
+        The slowness vector points in the direction of propagation.
+
+    :return: beam (dim: [number of sy, number of sx])
+    """
+    n_stats = K.shape[0]
+    # co-array, dim: [number of stations ** 2]
+    dx = (scoord[:, 0, None] - scoord[None, :, 0]).ravel()
+    dy = (scoord[:, 1, None] - scoord[None, :, 1]).ravel()
+    c = K.ravel()
+
+    # for small co-arrays and grids, the matrix product is faster than the NUFFT
+    large = sx.size > 1 and sy.size > 1 and dx.size * sx.size * sy.size > 1.e8
+    if large and finufft is None:
+        warnings.warn("finufft is not installed, the beam is evaluated by matrix products "
+                      "instead of the (faster) non-uniform FFT.")
+    if large and finufft is not None:
+        # shift grid to the (centered) modes of the NUFFT
+        mx = sx.size // 2
+        my = sy.size // 2
+        c = c * np.exp(1j * 2. * np.pi * freq * (dx * sx[mx] + dy * sy[my]))
+        # the modes are integer, so the points can be wrapped to [-pi, pi)
+        px = np.mod(2. * np.pi * freq * (sx[1] - sx[0]) * dx + np.pi, 2. * np.pi) - np.pi
+        py = np.mod(2. * np.pi * freq * (sy[1] - sy[0]) * dy + np.pi, 2. * np.pi) - np.pi
+        beam = finufft.nufft2d1(py, px, c.astype(complex), (sy.size, sx.size), isign=1, eps=1.e-9)
+    else:
+        ex = np.exp(1j * 2. * np.pi * freq * dx[:, None] * sx[None, :])
+        ey = np.exp(1j * 2. * np.pi * freq * dy[:, None] * sy[None, :])
+        beam = np.dot((c[:, None] * ey).T, ex)
+
+    return abs(beam) / n_stats
+
+
+
+def plwave_beamformer_sxsy(data, scoord, smax, ds, fmin, fmax, Fs, w_length, w_delay, df=0.2,
         neig=0, norm=True):
     """
-    This routine estimates the back azimuth and phase velocity of incoming waves
-    based on the algorithm presented in Corciulo et al., 2012 (in Geophysics).
-    Can also be used to focus the beam to a certain coordinate, which must be
-    specified with xmax, ymax, zmax. In this case, dx, dy, and dz need to be set
-    to zero!
-    
+    Fast version of "plwave_beamformer" (bartlett processor) for Cartesian slowness grids.
+    The beam is evaluated for all grid points at once with a non-uniform FFT (see sxsy_beam),
+    which makes dense slowness maps affordable.
+
     :type data: numpy.ndarray
     :param data: time series of used stations (dim: [number of samples, number of stations])
     :type scoord: numpy.ndarray
     :param scoord: UTM coordinates of stations (dim: [number of stations, 2])
-    :type xrng, yrng, zrng: tuple
-    :param xrng, yrng, zrng: parameters for spatial grid search. Grid ranges
-        from xrng[0] to xrng[1], yrng[0] to yrng[1], and zrng[0] to zrng[1].
-    :type dx, dy, dz: float
-    :param dx, dy, dz: grid resolution; increment from xrng[0] to xrng[1],
-        yrng[0] to yrng[1], zrng[0] to zrng[1]
-    :type svrng: tuple
-    :param svrng: slowness interval used to calculate replica vector
+    :type smax: float
+    :param smax: maximum slowness in s/km. Both slowness components range from -smax to smax
     :type ds: float
-    :param ds: slowness step used to calculate replica vector
-    :type slow: boolean 
-    :param slow: if true, svmin, svmax, dsv are slowness values. if false, velocity values
+    :param ds: slowness step in s/km
     :type fmin, fmax: float
     :param fmin, fmax: frequency range for which the beamforming result is calculated
     :type Fs: float
@@ -556,27 +1733,450 @@ def matchedfield_beamformer(data, scoord, xrng, yrng, zrng, dx, dy, dz, svrng, d
     :param w_length: length of sliding window in seconds. result is "averaged" over windows
     :type w_delay: float
     :param w_delay: delay of sliding window in seconds with respect to previous window
-    :type processor: string
-    :param processor: processor used to match the cross-spectral-density matrix to the
-        replica vecotr. see Corciulo et al., 2012
     :type df: float
     :param df: frequency step between fmin and fmax
-    :type neig: integer
-    :param neig: number of dominant CSDM eigenvectors to annul from the data.
-        enables to suppress strong sources.
+    :type neig: int
+    :param neig: number of eigenvalues to project out
     :type norm: boolean
     :param norm: if True (default), beam power is normalized
 
-    :return: four numpy arrays:
-        xcoord: grid coordinates in x-direction (dim: [number x-grid points, 1])
-        ycoord: grid coordinates in y-direction (dim: [number y-grid points, 1])
-        c: phase velocity (dim: [number of cs, 1])
-        beamformer (dim: [number y-grid points, number x-grid points, number cs])
+    :return: three numpy arrays:
+        sx: slowness in x (east) direction in s/km (dim: [number of sx])
+        sy: slowness in y (north) direction in s/km (dim: [number of sy])
+        beamformer (dim: [number of sy, number of sx])
+        The slowness vector points in the direction of propagation, i.e. the back azimuth
+        is (degrees(arctan2(sx, sy)) + 180) % 360.
     """
+    sx = sxsy_grid(smax, ds)
+    sy = sxsy_grid(smax, ds)
 
-    # number of stations
+    # construct analysis frequencies
+    freq = np.arange(fmin, fmax+df, df)
+    # construct matrix for DFT calculation
+    # dim: [number time points, number frequencies]
+    matrice_int = dft_matrix(w_length, Fs, freq)
+    # calculate DFTs, dim: [number of frequencies, number of stations, number of shots]
+    vect_data = calculate_DFT(data, matrice_int, int(w_delay * Fs))
+
+    # calculate CSDMs and beams, averaged over frequencies
+    beamformer = np.zeros((sy.size, sx.size))
+    for ll in range(freq.size):
+        K = calculate_CSDM(vect_data[ll,:,:], neig, norm)
+        beamformer += sxsy_beam(K, scoord, freq[ll], sx, sy)
+    beamformer /= freq.size
+
+    return sx*1000., sy*1000., beamformer
+
+
+
+def array_response_sxsy(scoord, smax, ds, freq):
+    """
+    Array response on the Cartesian slowness grid of "plwave_beamformer_sxsy", i.e. the
+    beam of a vertically incident plane wave, evaluated with a non-uniform FFT.
+    :param scoord: UTM coordinates of stations (dim: [number of stations, 2])
+    :param smax: maximum slowness in s/km
+    :param ds: slowness step in s/km
+    :param freq: frequency, or array of frequencies the response is averaged over
+
+    :return: three numpy arrays:
+        sx: slowness in x (east) direction in s/km (dim: [number of sx])
+        sy: slowness in y (north) direction in s/km (dim: [number of sy])
+        response, between 0 and 1 (dim: [number of sy, number of sx])
+    """
+    sx = sxsy_grid(smax, ds)
+    sy = sxsy_grid(smax, ds)
+    n_stats = scoord.shape[0]
+    # normalized CSDM of a vertically incident plane wave
+    K = np.ones((n_stats, n_stats)) / n_stats
+    freq = np.atleast_1d(freq)
+    response = np.zeros((sy.size, sx.size))
+    for f in freq:
+        response += sxsy_beam(K, scoord, f, sx, sy)
+    response /= freq.size
+
+    return sx*1000., sy*1000., response
+
+
+
+# cache of array responses used by plwave_clean, keyed by geometry and frequencies
+response_cache = OrderedDict()
+
+
+
+def array_response_cached(scoord, freq, smax, ds, maxsize=16):
+    """
+    Array response (bartlett beam of a single plane wave, averaged over frequencies) as a
+    function of the slowness difference to the source, on a Cartesian grid. As the response
+    depends only on the geometry and the frequencies, it is calculated once and cached
+    (keeping the maxsize most recently used responses).
+    :param scoord: UTM coordinates of stations (dim: [number of stations, 2])
+    :param freq: analysis frequencies
+    :param smax: maximum slowness difference in s/m
+    :param ds: slowness step in s/m
+
+    :return: two numpy arrays:
+        sx: slowness differences of the grid in s/m (same for both directions, multiples
+            of ds covering -smax to smax)
+        response (dim: [number of sx, number of sx])
+    """
+    coords = scoord[:, :2] - np.mean(scoord[:, :2], axis=0)
+    freq = np.atleast_1d(np.asarray(freq, dtype=float))
+    key = (coords.tobytes(), freq.tobytes(), float(smax), float(ds))
+    if key in response_cache:
+        response_cache.move_to_end(key)
+        return response_cache[key]
+
+    # grid symmetric about and including zero slowness difference
+    m = int(np.ceil(smax / ds))
+    sx = ds * np.arange(-m, m + 1)
+    n_stats = coords.shape[0]
+    K = np.ones((n_stats, n_stats)) / n_stats
+    response = np.zeros((sx.size, sx.size))
+    for f in freq:
+        response += sxsy_beam(K, coords, f, sx, sx)
+    response /= freq.size
+
+    response_cache[key] = (sx, response)
+    if len(response_cache) > maxsize:
+        response_cache.popitem(last=False)
+    return sx, response
+
+
+
+def plwave_clean(beam, baz, s, scoord, fmin, fmax, df=0.2, gain=0.5, niter=50, thresh=0.1):
+    """
+    CLEAN deconvolution of a plane wave (bartlett) beam. Iteratively, the array response
+    of the strongest peak, scaled by gain times its beam power, is subtracted from the beam,
+    which removes the side lobes of strong sources masking weaker ones. The array response
+    is taken from a cache (see array_response_cached), so that several sources are resolved
+    from a single beamforming pass.
+    :param beam: beam as returned by plwave_beamformer (dim: [number of ss, number of bazs])
+    :param baz: back azimuth as returned by plwave_beamformer (dim: [number of bazs])
+    :param s: slowness in s/km as returned by plwave_beamformer (dim: [number of ss])
+    :param scoord: UTM coordinates of stations (dim: [number of stations, 2])
+    :param fmin, fmax: frequency range used for beamforming
+    :param df: frequency step used for beamforming
+    :param gain: fraction of the peak beam power subtracted per iteration
+    :param niter: maximum number of iterations
+    :param thresh: iterations stop if the remaining maximum drops below thresh times
+        the maximum of the beam
+
+    :return: three numpy arrays:
+        residual: beam after subtraction of all components (dim: [number of ss, number of bazs])
+        clean: beam power of the CLEAN components on the grid (dim: [number of ss, number of bazs])
+        sources: baz, slowness (s/km) and beam power of the CLEAN components, sorted by
+            decreasing beam power (dim: [number of components, 3])
+    """
+    freq = np.arange(fmin, fmax+df, df)
+    # Cartesian slowness vectors (direction of propagation) of the grid in s/m
+    baz_, s_ = np.meshgrid(baz, s / 1000.)
+    px = -s_ * np.sin(np.radians(baz_))
+    py = -s_ * np.cos(np.radians(baz_))
+
+    # array response for slowness differences up to twice the maximum slowness
+    smax = 2. * s.max() / 1000.
+    aperture = np.sqrt(np.sum(np.ptp(scoord[:, :2], axis=0)**2))
+    ds = min(1. / (4. * freq.max() * aperture), smax / 10.)
+    sx, response = array_response_cached(scoord, freq, smax, ds)
+
+    residual = beam.copy()
+    clean = np.zeros(beam.shape)
+    pow0 = np.nanmax(beam)
+    for it in range(niter):
+        ind = np.unravel_index(np.nanargmax(residual), beam.shape)
+        if residual[ind] < thresh * pow0:
+            break
+        comp = gain * residual[ind]
+        # interpolate response at slowness differences to the component
+        ix = (px - px[ind] - sx[0]) / ds
+        iy = (py - py[ind] - sx[0]) / ds
+        resp = ndimage.map_coordinates(response, [iy.ravel(), ix.ravel()], order=1,
+                                       mode="nearest").reshape(beam.shape)
+        residual -= comp * resp
+        clean[ind] += comp
+
+    ind = np.nonzero(clean)
+    order = np.argsort(clean[ind], kind="stable")[::-1]
+    sources = np.column_stack((baz[ind[1][order]] % 360, s[ind[0][order]], clean[ind][order]))
+    return residual, clean, sources
+
+
+
+def delaysum_beamformer(data, scoord, svmin, svmax, dsv, slow, fmin, fmax, Fs, w_length,
+        w_delay, baz=None, interpolate=True, norm=True, dbaz=2, Fs_screen=None):
+    """
+    Time-domain delay-and-sum (shift-and-stack) beamformer. Searches the same back
+    azimuth / slowness grid as "plwave_beamformer" but works on the bandpass filtered
+    time series directly. It is not cheaper than "plwave_beamformer"; for screening event
+    windows it should be used with a coarse grid (see auto_grid) and decimated data
+    (Fs_screen of about 8 * fmax).
+
+    :type data: numpy.ndarray
+    :param data: time series of used stations (dim: [number of samples, number of stations])
+    :type scoord: numpy.ndarray
+    :param scoord: UTM coordinates of stations (dim: [number of stations, 2])
+    :type svmin, svmax: float
+    :param svmin, svmax: slowness/velocity interval of the grid search
+    :type dsv: float
+    :param dsv: slowness/velocity step of the grid search
+    :type slow: boolean
+    :param slow: if true, svmin, svmax, dsv are slowness values. if false, velocity values
+    :type fmin, fmax: float
+    :param fmin, fmax: corner frequencies of the bandpass applied prior to stacking
+    :type Fs: float
+    :param Fs: sampling rate of data streams
+    :type w_length: float
+    :param w_length: length of sliding window in seconds. result is averaged over windows
+    :type w_delay: float
+    :param w_delay: delay of sliding window in seconds with respect to previous window
+    :type baz: float
+    :param baz: Back azimuth. If given, the beam is calculated only for this specific back azimuth
+    :type interpolate: boolean
+    :param interpolate: if True (default), fractional delays are accounted for by linear
+        interpolation between neighbouring samples. Otherwise delays are rounded
+        to the nearest sample.
+    :type norm: boolean
+    :param norm: if True (default), the beam is given as semblance (between 0 and 1).
+        Otherwise the mean power of the stacked trace is returned.
+    :type dbaz: float
+    :param dbaz: back azimuth step of the grid search in degrees
+    :type Fs_screen: float
+    :param Fs_screen: if given, the filtered data are decimated by an integer factor to a
+        sampling rate of at least Fs_screen (which should be well above 2 * fmax).
+
+    :return: three numpy arrays:
+        teta: back azimuth (dim: [number of bazs, 1])
+        s: slowness (dim: [number of ss, 1])
+        beamformer (dim: [number of ss, number of bazs])
+    """
+
+    # grid for search over backazimuth and apparent velocity
+    teta, s = plwave_grid(svmin, svmax, dsv, slow, baz, dbaz)
+    teta_, s_ = np.meshgrid(teta, s)
+    n_param = teta_.size
+    teta_ = teta_.reshape(n_param)
+    s_ = s_.reshape(n_param)
+
+    # filter data
+    if fmin > 0:
+        sos = signal.butter(4, [fmin, fmax], btype="bandpass", fs=Fs, output="sos")
+    else:
+        sos = signal.butter(4, fmax, btype="lowpass", fs=Fs, output="sos")
+    data = signal.sosfiltfilt(sos, data, axis=0)
+    # decimate (data are already lowpass filtered)
+    if Fs_screen is not None:
+        q = max(1, int(Fs // Fs_screen))
+        data = data[::q]
+        Fs = Fs / q
+
+    # sliding windows ('shots'), only the samples of the windows are stacked
+    npts_win = np.arange(0, w_length, 1./Fs).size
+    npts_delay = max(1, int(w_delay * Fs))
+    nshots = int(np.floor((data.shape[0] - npts_win) / npts_delay)) + 1
+    starts = np.arange(nshots) * npts_delay
+    npts = starts[-1] + npts_win
     n_stats = data.shape[1]
 
+    # delays in samples with respect to the array center
+    # dim: [number of stations, number of parameters]
+    x = scoord[:, 0] - np.mean(scoord[:, 0])
+    y = scoord[:, 1] - np.mean(scoord[:, 1])
+    lags = (x[:, None] * np.cos(np.radians(90 - teta_)) \
+          + y[:, None] * np.sin(np.radians(90 - teta_))) * s_ * Fs
+    if interpolate:
+        shift = np.floor(lags).astype(int)
+        frac = lags - shift
+    else:
+        shift = np.round(lags).astype(int)
+    # pad data with zeros so that all shifted samples exist
+    pad = abs(shift).max() + 1
+    data = np.pad(data, ((pad, pad + 1), (0, 0)))
+
+    # initialize beamformer
+    beamformer = np.zeros(n_param)
+
+    # shift and stack, vectorised over grid points. grid points are processed in
+    # chunks to limit memory consumption
+    # (the shifted traces are rows of a sliding window view of each trace)
+    nchunk = max(1, 2**22 // npts)
+    views = [sliding_window_view(np.ascontiguousarray(data[:, ii]), npts) for ii in range(n_stats)]
+    for c in range(0, n_param, nchunk):
+        p = slice(c, c + nchunk)
+        stack = np.zeros((shift[:, p].shape[1], npts))
+        energy = np.zeros(stack.shape)
+        for ii in range(n_stats):
+            ind = shift[ii, p] + pad
+            shifted = views[ii][ind]
+            if interpolate:
+                shifted = shifted + frac[ii, p][:, None] * (views[ii][ind + 1] - shifted)
+            stack += shifted
+            if norm:
+                energy += shifted**2
+        # sum over the samples of each window using cumulative sums
+        pow_stack = np.cumsum(np.pad(stack**2, ((0, 0), (1, 0))), axis=1)
+        pow_stack = pow_stack[:, starts + npts_win] - pow_stack[:, starts]
+        if norm:
+            pow_energy = np.cumsum(np.pad(energy, ((0, 0), (1, 0))), axis=1)
+            pow_energy = pow_energy[:, starts + npts_win] - pow_energy[:, starts]
+            pow_energy[pow_energy == 0] = np.finfo(float).tiny
+            beam = pow_stack / (n_stats * pow_energy)
+        else:
+            beam = pow_stack / (npts_win * n_stats**2)
+        # average over windows
+        beamformer[p] = np.mean(beam, axis=1)
+
+    # reshape, dim: [number slowness, number baz]
+    beamformer = np.reshape(beamformer, (s.size, teta.size))
+    teta -= 180
+    return teta, s*1000., beamformer
+
+
+def beampower_detector(data, scoord, svmin, svmax, dsv, slow, fmin, fmax, Fs, t_win, t_step,
+        thrsh1, thrsh2, dbaz=10, t_block=600.):
+    """
+    Continuous detector based on the time-domain delay-and-sum beamformer. The semblance
+    of sliding windows is calculated on a coarse back azimuth / slowness grid, and events
+    are triggered on the maximum semblance over the grid (the beam power). Triggered events
+    already carry back azimuth and slowness of the window with the highest beam power.
+    Integer sample delays are used, which allows calculating the energy of the shifted
+    traces from cumulative sums computed once per station and block.
+    The data are processed in blocks of windows, each filtered with a margin of the length
+    of the filter's impulse response and extended by the maximum delay, so that only one
+    block is held in memory as float64 at a time.
+
+    :type data: numpy.ndarray
+    :param data: continuous time series of used stations (dim: [number of samples, number of stations])
+    :type scoord: numpy.ndarray
+    :param scoord: UTM coordinates of stations (dim: [number of stations, 2])
+    :type svmin, svmax: float
+    :param svmin, svmax: slowness/velocity interval of the grid search
+    :type dsv: float
+    :param dsv: slowness/velocity step of the grid search
+    :type slow: boolean
+    :param slow: if true, svmin, svmax, dsv are slowness values. if false, velocity values
+    :type fmin, fmax: float
+    :param fmin, fmax: corner frequencies of the bandpass applied prior to stacking
+    :type Fs: float
+    :param Fs: sampling rate of data streams
+    :type t_win: float
+    :param t_win: length of the detection windows in seconds
+    :type t_step: float
+    :param t_step: step between detection windows in seconds
+    :type thrsh1, thrsh2: float
+    :param thrsh1, thrsh2: beam power (semblance) thresholds to trigger / stop trigger
+    :type dbaz: float
+    :param dbaz: back azimuth step of the grid search in degrees
+    :type t_block: float
+    :param t_block: length of the processing blocks in seconds. If None, the data are
+        processed at once.
+
+    :return: five numpy arrays:
+        times: start times of the detection windows in seconds (dim: [number of windows])
+        beampow: beam power of the windows (dim: [number of windows])
+        baz: back azimuth of the beam power maximum (dim: [number of windows])
+        s: slowness (in s/km) of the beam power maximum (dim: [number of windows])
+        events: on time, off time (in seconds), back azimuth, slowness (in s/km) and beam power
+            of the triggered events (dim: [number of events, 5])
+    """
+    # number of stations and data points
+    npts, n_stats = data.shape
+
+    # coarse grid for search over backazimuth and apparent velocity
+    teta, s = plwave_grid(svmin, svmax, dsv, slow, dbaz=dbaz)
+    teta_, s_ = np.meshgrid(teta, s)
+    n_param = teta_.size
+    teta_ = teta_.reshape(n_param)
+    s_ = s_.reshape(n_param)
+
+    # filter
+    if fmin > 0:
+        sos = signal.butter(4, [fmin, fmax], btype="bandpass", fs=Fs, output="sos")
+    else:
+        sos = signal.butter(4, fmax, btype="lowpass", fs=Fs, output="sos")
+    # filter margin of blocks: length of the impulse response (decay to 1e-10 of its maximum)
+    imp = np.zeros(int(np.ceil(100. * Fs / (fmin if fmin > 0 else fmax))))
+    imp[0] = 1.
+    h = abs(signal.sosfilt(sos, imp))
+    margin = np.nonzero(h > 1.e-10 * h.max())[0][-1] + 1
+
+    # delays in samples with respect to the array center
+    # dim: [number of stations, number of parameters]
+    x = scoord[:, 0] - np.mean(scoord[:, 0])
+    y = scoord[:, 1] - np.mean(scoord[:, 1])
+    shift = np.round((x[:, None] * np.cos(np.radians(90 - teta_)) \
+          + y[:, None] * np.sin(np.radians(90 - teta_))) * s_ * Fs).astype(int)
+    # blocks are extended by pad samples so that all shifted samples exist (zeros outside of data)
+    pad = abs(shift).max()
+
+    # detection windows
+    npts_win = int(round(t_win * Fs))
+    npts_step = int(round(t_step * Fs))
+    nwin = (npts - npts_win) // npts_step + 1
+    if t_block is None:
+        nwin_block = nwin
+    else:
+        nwin_block = max(1, int(round(t_block * Fs)) // npts_step)
+
+    # beam power and grid index of its maximum for all windows
+    beampow = np.zeros(nwin)
+    ind_max = np.zeros(nwin, dtype=int)
+    for w0 in range(0, nwin, nwin_block):
+        w1 = min(w0 + nwin_block, nwin)
+        # first sample and number of samples of the windows of the block
+        a = w0 * npts_step
+        n_blk = (w1 - 1 - w0) * npts_step + npts_win
+        # filter block with margin (first and last block up to the ends of the data)
+        i0 = 0 if w0 == 0 else max(a - pad - margin, 0)
+        i1 = npts if w1 == nwin else min(a + n_blk + pad + margin, npts)
+        seg = signal.sosfiltfilt(sos, np.asarray(data[i0:i1], dtype=float), axis=0)
+        blk = np.zeros((n_blk + 2 * pad, n_stats))
+        j0 = max(a - pad, 0)
+        j1 = min(a + n_blk + pad, npts)
+        blk[j0 - a + pad: j1 - a + pad] = seg[j0 - i0: j1 - i0]
+        del seg
+        # energy of the single stations, summed cumulatively
+        energy = np.cumsum(np.pad(blk**2, ((1, 0), (0, 0))), axis=0)
+        starts = np.arange(w1 - w0) * npts_step + pad
+
+        for p in range(n_param):
+            stack = np.zeros(n_blk)
+            pow_energy = np.zeros(w1 - w0)
+            for ii in range(n_stats):
+                stack += blk[pad + shift[ii, p]: pad + shift[ii, p] + n_blk, ii]
+                pow_energy += energy[starts + shift[ii, p] + npts_win, ii] - energy[starts + shift[ii, p], ii]
+            pow_stack = np.cumsum(np.pad(stack**2, (1, 0)))
+            pow_stack = pow_stack[starts - pad + npts_win] - pow_stack[starts - pad]
+            pow_energy[pow_energy == 0] = np.finfo(float).tiny
+            semblance = pow_stack / (n_stats * pow_energy)
+            ind = semblance > beampow[w0:w1]
+            beampow[w0:w1][ind] = semblance[ind]
+            ind_max[w0:w1][ind] = p
+        del blk, energy
+
+    times = np.arange(nwin) * npts_step / Fs
+    baz = (teta_[ind_max] - 180) % 360
+    s = s_[ind_max] * 1000.
+
+    # trigger on beam power, back azimuth and slowness are taken from the window with the
+    # highest beam power
+    on_off = trigger_onset(beampow, thrsh1, thrsh2)
+    events = np.zeros((len(on_off), 5))
+    for i, (on, off) in enumerate(on_off):
+        w = on + np.argmax(beampow[on: off + 1])
+        events[i] = [times[on], times[off] + t_win, baz[w], s[w], beampow[w]]
+
+    return times, beampow, baz, s, events
+
+
+def matchedfield_grid(xrng, yrng, zrng, dx, dy, dz, svrng, ds, slow):
+    """
+    Set up the spatial and slowness grid searched by the matched field beamformer.
+    See "matchedfield_beamformer" for a description of the parameters.
+
+    :return: four numpy arrays:
+        xcoord, ycoord, zcoord: grid coordinates in x-, y- and z-direction
+        s: slowness in s/m
+    """
     # grid for search over location
     # if beam is fixed to a coordinate in x, y, or z
     if yrng[0] == yrng[1]:
@@ -594,18 +2194,6 @@ def matchedfield_beamformer(data, scoord, xrng, yrng, zrng, dx, dy, dz, svrng, d
         zcoord = np.array([zrng[0]])
     else:
         zcoord = np.arange(zrng[0], zrng[1] + dz, dz)
-    # create meshgrids
-    ygrid, xgrid = np.meshgrid(ycoord, xcoord)
-    zgrid = np.zeros(xgrid.shape)
-    ygrid = ygrid.reshape(ygrid.size)
-    xgrid = xgrid.reshape(xgrid.size)
-    zgrid = zgrid.reshape(zgrid.size)
-    if zcoord.size > 1:
-        ygrid = np.tile(ygrid, zcoord.size)
-        xgrid = np.tile(xgrid, zcoord.size)
-        zgrid_ = np.copy(zgrid)
-        for i in range(zcoord.size - 1):
-            zgrid = np.concatenate((zgrid, zgrid_ + zcoord[i+1]))
 
     # grid for search over slowness
     if svrng[0] == svrng[1]:
@@ -614,83 +2202,272 @@ def matchedfield_beamformer(data, scoord, xrng, yrng, zrng, dx, dy, dz, svrng, d
         s = np.arange(svrng[0], svrng[1] + ds, ds) / 1000.
     if not slow:
         s = 1. / (s * 1.e6)
-    # extend coordinate grids and slowness grid
-    sgrid = np.zeros(xgrid.size) + s[0]
-    ssize = sgrid.size
-    if s.size > 1:
-        ygrid = np.tile(ygrid, s.size)
-        xgrid = np.tile(xgrid, s.size)
-        zgrid = np.tile(zgrid, s.size)
-        for i in range(s.size - 1):
-            sgrid = np.concatenate((sgrid, np.zeros(ssize) + s[i+1]))
-    # reshape for efficient calculation
-    xscoord = np.tile(scoord[:,0].reshape(n_stats, 1), (1, xgrid.size))
-    yscoord = np.tile(scoord[:,1].reshape(n_stats, 1), (1, ygrid.size))
-    ygrid = np.tile(ygrid, (n_stats, 1))
-    xgrid = np.tile(xgrid, (n_stats, 1))
-    zgrid = np.tile(zgrid, (n_stats, 1))
-    sgrid = np.tile(sgrid, (n_stats, 1))
-    # number of parameter combinations
-    n_param = xgrid.shape[1]
+    return xcoord, ycoord, zcoord, s
 
-    # extract number of data points
-    npts = data[:, 1].size
-    # construct analysis frequencies
-    freq = np.arange(fmin, fmax + df, df)
-    # construct time vector for sliding window 
-    w_time = np.arange(0, w_length, 1./Fs)
-    npts_win = w_time.size
-    npts_delay = int(w_delay * Fs)
-    # number of analysis windows ('shots')
-    nshots = int(np.floor((npts - w_time.size) / npts_delay)) + 1
 
-    # initialize data steering vector:
-    # dim: [number of frequencies, number of stations, number of analysis windows]
-    vect_data = np.zeros((freq.size, n_stats, nshots), dtype=np.complex)
 
+def matchedfield_params(xcoord, ycoord, zcoord, s):
+    """
+    Flatten the matched field grid to parameter combinations. The parameter
+    combinations are ordered such that reshaping to [number y-grid points,
+    number x-grid points, number z-grid points, number ss] with order="F"
+    restores the grid.
+
+    :return: four numpy arrays xgrid, ygrid, zgrid, sgrid (dim: [number of parameters])
+    """
+    ygrid, xgrid, zgrid, sgrid = np.meshgrid(ycoord, xcoord, zcoord, s, indexing="ij")
+    return xgrid.ravel(order="F"), ygrid.ravel(order="F"), zgrid.ravel(order="F"), \
+           sgrid.ravel(order="F")
+
+
+
+def matchedfield_delays(scoord, xgrid, ygrid, zgrid, sgrid):
+    """
+    Travel time delays of point sources at the stations.
+    :param scoord: UTM coordinates of stations (dim: [number of stations, 2])
+    :param xgrid, ygrid, zgrid: source coordinates (dim: [number of parameters])
+    :param sgrid: slownesses in s/m (dim: [number of parameters])
+
+    :return: delays (dim: [number of stations, number of parameters])
+    """
+    return np.sqrt((scoord[:, 0, None] - xgrid)**2 + (scoord[:, 1, None] - ygrid)**2 \
+                   + zgrid**2) * sgrid
+
+
+
+def matchedfield_setup(scoord, xrng, yrng, zrng, dx, dy, dz, svrng, ds, slow, fmin, fmax,
+        Fs, w_length, df=0.2, auto=False, replicas=False):
+    """
+    Set up everything "matchedfield_beamformer" needs besides the data: grid, travel time
+    delays, analysis frequencies, DFT matrix and, optionally, the replica vectors of all
+    frequencies (see plwave_setup). See "matchedfield_beamformer" for the parameters.
+    :type replicas: boolean
+    :param replicas: if True, the replica vectors are calculated as well (memory:
+        number of frequencies * number of stations * number of parameters complex values)
+
+    :return: dictionary with xcoord, ycoord, zcoord, s (slowness in s/m), tau (dim:
+        [number of stations, number of parameters]), freq, matrice_int (see dft_matrix)
+        and replicas (dim: [number of frequencies, number of stations, number of
+        parameters], None if not calculated)
+    """
+    # grid for search over location and slowness
+    xcoord, ycoord, zcoord, s = matchedfield_grid(xrng, yrng, zrng, dx, dy, dz, svrng, ds, slow)
+    if auto:
+        n_user = xcoord.size * ycoord.size * zcoord.size * s.size
+        ds, _, dx = auto_grid(scoord, fmax, svrng[0], svrng[1], slow)
+        dy = dz = dx
+        xcoord, ycoord, zcoord, s = matchedfield_grid(xrng, yrng, zrng, dx, dy, dz, svrng, ds, slow)
+        n_auto = xcoord.size * ycoord.size * zcoord.size * s.size
+        print("[INFO] auto grid: dx = dy = dz = %.1f m, ds = %.4f -> %i instead of %i grid points (%i saved)"
+              % (dx, ds, n_auto, n_user, n_user - n_auto))
+    # travel time delays of all stations for all parameter combinations
+    # dim: [number of stations, number of parameters]
+    tau = matchedfield_delays(scoord, *matchedfield_params(xcoord, ycoord, zcoord, s))
+
+    # construct analysis frequencies
+    freq = np.arange(fmin, fmax + df, df)
     # construct matrix for DFT calculation
     # dim: [number w_time points, number frequencies]
-    matrice_int = np.exp(2. * np.pi * 1j * np.dot(w_time[:, None], freq[:, None].T))
+    matrice_int = dft_matrix(w_length, Fs, freq)
+    if replicas:
+        replicas = np.array([replica_vector(tau, f) for f in freq])
+    else:
+        replicas = None
+    return {"xcoord": xcoord, "ycoord": ycoord, "zcoord": zcoord, "s": s, "tau": tau,
+            "freq": freq, "matrice_int": matrice_int, "replicas": replicas}
 
-    # initialize array for beamformer 
-    beamformer = np.zeros(n_param)
 
-    # calculate DFTs 
-    for ii in range(n_stats):
-        toto = data[:, ii]
-        # now loop over shots
-        n = 0
-        while (n * npts_delay + npts_win) <= npts:
-            # calculate DFT
-            # dim: [number frequencies]
-            adjust = np.dot(toto[n*npts_delay: n*npts_delay+npts_win][:, None],
-                            np.ones((1, freq.size)))
-            # mean averages over time axis
-            data_freq = np.mean(np.multiply(adjust, matrice_int), axis=0)
-            # fill data steering vector: ii'th station, n'th shot.
-            # normalize in order not to bias strongest seismogram.
-            # dim: [number frequencies, number stations, number shots]
-            vect_data[:, ii, n] = (data_freq / abs(data_freq)).conj().T
-            n += 1
 
+def matchedfield_beamformer(data, scoord, xrng, yrng, zrng, dx, dy, dz, svrng, ds,
+        slow, fmin, fmax, Fs, w_length, w_delay,  processor="bartlett", df=0.2,
+        neig=0, norm=True, refine=None, npeaks=None, auto=False, nbh=1, setup=None):
+    """
+    This routine estimates the back azimuth and phase velocity of incoming waves
+    based on the algorithm presented in Corciulo et al., 2012 (in Geophysics).
+    Can also be used to focus the beam to a certain coordinate, which must be
+    specified with xmax, ymax, zmax. In this case, dx, dy, and dz need to be set
+    to zero!
+    
+    :type data: numpy.ndarray
+    :param data: time series of used stations (dim: [number of samples, number of stations]).
+        Can be a memory-mapped array or an iterator yielding consecutive chunks of the
+        time series (see calculate_DFT).
+    :type scoord: numpy.ndarray
+    :param scoord: UTM coordinates of stations (dim: [number of stations, 2])
+    :type xrng, yrng, zrng: tuple
+    :param xrng, yrng, zrng: parameters for spatial grid search. Grid ranges
+        from xrng[0] to xrng[1], yrng[0] to yrng[1], and zrng[0] to zrng[1].
+    :type dx, dy, dz: float
+    :param dx, dy, dz: grid resolution; increment from xrng[0] to xrng[1],
+        yrng[0] to yrng[1], zrng[0] to zrng[1]
+    :type svrng: tuple
+    :param svrng: slowness interval used to calculate replica vector
+    :type ds: float
+    :param ds: slowness step used to calculate replica vector
+    :type slow: boolean 
+    :param slow: if true, svmin, svmax, dsv are slowness values. if false, velocity values
+    :type fmin, fmax: float
+    :param fmin, fmax: frequency range for which the beamforming result is calculated
+    :type Fs: float
+    :param Fs: sampling rate of data streams
+    :type w_length: float
+    :param w_length: length of sliding window in seconds. result is "averaged" over windows
+    :type w_delay: float
+    :param w_delay: delay of sliding window in seconds with respect to previous window
+    :type processor: string or list
+    :param processor: processor used to match the cross-spectral-density matrix to the
+        replica vecotr. see Corciulo et al., 2012. If a list of processors is given
+        (e.g. ["bartlett", "adaptive"]), one beam per processor is calculated in a
+        single pass.
+    :type df: float
+    :param df: frequency step between fmin and fmax
+    :type neig: integer
+    :param neig: number of dominant CSDM eigenvectors to annul from the data.
+        enables to suppress strong sources.
+    :type norm: boolean
+    :param norm: if True (default), beam power is normalized
+    :type refine: string
+    :param refine: if "quadratic" or "gaussian", the location of the beam maximum is
+        refined below the grid resolution (see refine_peak) and the beam is evaluated
+        at the refined location.
+    :type npeaks: int
+    :param npeaks: if given, the npeaks strongest separated maxima of the beam are
+        returned (see find_peaks), e.g. for several simultaneous sources.
+    :type auto: boolean
+    :param auto: if True, dx, dy, dz and ds are replaced by the coarsest steps which
+        still sample the main lobe adequately (see auto_grid).
+    :type nbh: int or tuple
+    :param nbh: minimum separation of the maxima returned for npeaks in grid points
+        (y, x, z, slowness), see find_peaks
+    :type setup: dict
+    :param setup: precomputed setup as returned by matchedfield_setup (e.g. shared by
+        several time windows of the array). If given, the grid and frequency parameters
+        are ignored.
 
-    # loop over frequencies and perform beamforming
-    for ll in range(freq.size):
-        # calculate cross-spectral density matrix
-        # dim: [number of stations X number of stations]
-        K = calculate_CSDM(vect_data[ll,:,:], neig, norm)
+    :return: four numpy arrays:
+        xcoord: grid coordinates in x-direction (dim: [number x-grid points, 1])
+        ycoord: grid coordinates in y-direction (dim: [number y-grid points, 1])
+        c: phase velocity (dim: [number of cs, 1])
+        beamformer (dim: [number y-grid points, number x-grid points, number cs])
+        if refine is given, additionally a tuple (y, x, z, slowness, beam power) of the
+        refined maximum.
+        if npeaks is given, additionally an array containing y, x, z, slowness and beam
+        power of the strongest maxima (dim: [number of peaks, 5]).
+        if a list of processors is given, beamformer (and the refined maximum) are
+        lists with one entry per processor.
+    """
 
-        # calculate replica vector
-        replica = np.exp(-1j * np.sqrt((xscoord - xgrid)**2 \
-            + (yscoord - ygrid)**2 + zgrid**2) * 2. * np.pi * freq[ll] * sgrid)
-        replica /= np.linalg.norm(replica, axis=0)
-        replica = np.reshape(replica, (n_stats, n_param))
+    # grid, travel time delays, analysis frequencies and DFT matrix
+    if setup is None:
+        setup = matchedfield_setup(scoord, xrng, yrng, zrng, dx, dy, dz, svrng, ds, slow,
+                                   fmin, fmax, Fs, w_length, df, auto)
+    xcoord, ycoord, zcoord, s = setup["xcoord"], setup["ycoord"], setup["zcoord"], setup["s"]
+    tau, freq = setup["tau"], setup["freq"]
+    # calculate DFTs, dim: [number of frequencies, number of stations, number of shots]
+    vect_data = calculate_DFT(data, setup["matrice_int"], int(w_delay * Fs))
+
+    # calculate cross-spectral density matrices, dim: [number of frequencies, number of
+    # stations, number of stations], or snapshot matrices for the bartlett processor and
+    # less shots than stations, dim: [number of frequencies, number of stations, number of shots]
+    processors = processor if isinstance(processor, (list, tuple)) else [processor]
+    snapshots = all(proc == "bartlett" for proc in processors) \
+        and vect_data.shape[2] < vect_data.shape[1]
+    csdm = calculate_snapshots if snapshots else calculate_CSDM
+    K = np.array([csdm(vect_data[ll,:,:], neig, norm) for ll in range(freq.size)])
+
+    # perform beamforming, averaged over frequencies
+    # dim: [number of processors, n_param]
+    beamformer = evaluate_beam(tau, K, freq, processors, snapshots=snapshots,
+                               replicas=setup["replicas"])
+
+    # reshape beamformer
+    beamformer = [np.reshape(beam, (ycoord.size, xcoord.size, zcoord.size, s.size), order="F")
+                  for beam in beamformer]
+
+    # refine maximum and evaluate beam at refined location
+    if refine is not None:
+        peak = []
+        for i, proc in enumerate(processors):
+            (y_max, x_max, z_max, s_max), _ = refine_peak(beamformer[i], [ycoord, xcoord, zcoord, s],
+                                                          method=refine)
+            tau_max = matchedfield_delays(scoord, np.array([x_max]), np.array([y_max]),
+                                          np.array([z_max]), np.array([s_max]))
+            pow_max = evaluate_beam(tau_max, K, freq, proc, snapshots=snapshots)[0]
+            peak.append((y_max, x_max, z_max, s_max*1000., pow_max))
+
+    # strongest separated maxima
+    if npeaks is not None:
+        peaks = []
+        for i in range(len(processors)):
+            pks = find_peaks(beamformer[i], [ycoord, xcoord, zcoord, s], npeaks, nbh=nbh)
+            pks[:, 3] *= 1000.
+            peaks.append(pks)
+
+    if not isinstance(processor, (list, tuple)):
+        beamformer = beamformer[0]
+        if refine is not None:
+            peak = peak[0]
+        if npeaks is not None:
+            peaks = peaks[0]
+    res = (ycoord, xcoord, zcoord, s*1000., beamformer)
+    if refine is not None:
+        res += (peak,)
+    if npeaks is not None:
+        res += (peaks,)
+    return res
 
-        # do phase matching
-        beamformer += phase_matching(replica, K, processor)
 
-    # normalize beamformer and reshape
-    beamformer /= freq.size
-    beamformer = np.reshape(beamformer, (ycoord.size, xcoord.size,
-        zcoord.size, s.size), order="F")
-    return ycoord, xcoord, zcoord, s*1000., beamformer
+def matchedfield_beamformer_track(data, scoord, xrng, yrng, zrng, dx, dy, dz, svrng, ds,
+        slow, fmin, fmax, Fs, t_win, t_step, w_length, w_delay, processor="bartlett", df=0.2,
+        neig=0, norm=True, nbh=2, full_every=10, pow_drop=0.8, coh_min=None):
+    """
+    Matched field beamforming of consecutive time windows of continuous data (e.g. tremor).
+    The beam maximum is tracked from window to window such that most windows require
+    only the evaluation of a small neighbourhood of the grid (see "beam_tracking").
+
+    :type t_win: float
+    :param t_win: length of the consecutive time windows in seconds
+    :type t_step: float
+    :param t_step: step between consecutive time windows in seconds
+    :type nbh: int or tuple
+    :param nbh: half width of the neighbourhood in grid points (y, x, z, slowness)
+    :type full_every: int
+    :param full_every: a full grid search is done at least every full_every windows
+    :type pow_drop: float
+    :param pow_drop: a full grid search is done if the beam power drops below pow_drop
+        times the beam power of the last full grid search
+    :type coh_min: float
+    :param coh_min: if given, windows with a CSDM coherence below coh_min are not beamformed
+        (see "beam_tracking")
+    See "matchedfield_beamformer" for all other parameters.
+
+    :return: eight arrays:
+        ycoord, xcoord, zcoord: grid coordinates
+        s: slowness (dim: [number of ss])
+        times: start times of the time windows in seconds (dim: [number of windows])
+        beams: list of beams, np.nan where not evaluated (dim: [number y-grid points,
+            number x-grid points, number z-grid points, number ss]). None for windows
+            without coherent arrival.
+        peaks: y, x, z, slowness and beam power of the maxima, np.nan for windows without
+            coherent arrival (dim: [number of windows, 5])
+        full: True for windows for which a full grid search was done
+    """
+    # grid for search over location and slowness
+    xcoord, ycoord, zcoord, s = matchedfield_grid(xrng, yrng, zrng, dx, dy, dz, svrng, ds, slow)
+    tau = matchedfield_delays(scoord, *matchedfield_params(xcoord, ycoord, zcoord, s))
+    # construct analysis frequencies
+    freq = np.arange(fmin, fmax + df, df)
+
+    shape = (ycoord.size, xcoord.size, zcoord.size, s.size)
+    times, beams, full = beam_tracking(data, tau, shape, "F", [False] * 4, freq, Fs, t_win,
+                                       t_step, w_length, w_delay, processor, neig, norm, nbh,
+                                       full_every, pow_drop, coh_min)
+
+    # parameters of beam maxima
+    peaks = np.zeros((times.size, 5)) * np.nan
+    for w in range(times.size):
+        if beams[w] is None:
+            continue
+        ind = np.unravel_index(np.nanargmax(beams[w]), beams[w].shape)
+        peaks[w] = ycoord[ind[0]], xcoord[ind[1]], zcoord[ind[2]], s[ind[3]]*1000., beams[w][ind]
+    return ycoord, xcoord, zcoord, s*1000., times, beams, peaks, full
@@ -10,6 +10,7 @@ import sys
 import datetime
 from scipy.special import struve
 from obspy import UTCDateTime
+from glseis.array_analysis import refine_peak, find_peaks
 
 
 
@@ -86,7 +87,7 @@ def ascii_header():
     return header
 
 
-def load_beams(fn, method, t1=None, t2=None, powmin=0, slowness=None):
+def load_beams(fn, method, t1=None, t2=None, powmin=0, slowness=None, refine=None, npeaks=None, nbh=1):
     """
     Load beamforming arrays and return parameters associated with the maximum
     beam power.
@@ -98,6 +99,15 @@ def load_beams(fn, method, t1=None, t2=None, powmin=0, slowness=None):
     :param powmin: beam power threshold
     :param slowness: if not None, beamforming reslults associcated with
         the closes slowness value will be extracted.
+    :param refine: if "quadratic" or "gaussian", the parameters of the maximum
+        are refined below the grid resolution by fitting the beam around the
+        grid maximum (see array_analysis.refine_peak).
+    :param npeaks: if not None, additionally the npeaks strongest separated
+        maxima of each beam are returned (see array_analysis.find_peaks), given
+        as baz, slowness/velocity, beam power ('plw') or x, y, z,
+        slowness/velocity, beam power ('mfp').
+    :param nbh: minimum separation of these maxima in grid points, one value or
+        one value per beam dimension (see array_analysis.find_peaks)
     """
 
     # dictionary containing all data
@@ -116,6 +126,11 @@ def load_beams(fn, method, t1=None, t2=None, powmin=0, slowness=None):
             ycoord = data["ycoord"]
             zcoord = data["zcoord"]
 
+        # skip windows without coherent arrival (not beamformed)
+        ind = [i for i, beam in enumerate(beams) if beam is not None]
+        times = np.array(times)[ind]
+        beams = [beams[i] for i in ind]
+
         # load only beamforming results for a certain slowness
         if slowness is not None:
             ind = np.argmin(abs(vel - slowness))
@@ -131,17 +146,47 @@ def load_beams(fn, method, t1=None, t2=None, powmin=0, slowness=None):
             vel = np.array([vel[ind]])
 
         # max beam power, slowness/velocity and baz values
-        pows = [np.max(beam) for beam in beams]
-        inds_max = [np.unravel_index(np.argmax(beam), beam.shape) \
-                for beam in beams]
-        if method == "plw":
-            vels = [vel[ind[0]] for ind in inds_max]
-            bazs = [baz[ind[1]] for ind in inds_max]
-        elif method == "mfp":
-            vels = [vel[ind[3]] for ind in inds_max]
-            xepi = [xcoord[ind[1]] for ind in inds_max]
-            yepi = [ycoord[ind[0]] for ind in inds_max]
-            zhyp = [zcoord[ind[2]] for ind in inds_max]
+        if refine is not None:
+            if method == "plw":
+                peaks = [refine_peak(beam, [vel, baz], [None, 360.], refine) \
+                        for beam in beams]
+                vels = [peak[0][0] for peak in peaks]
+                bazs = [peak[0][1] % 360 for peak in peaks]
+            elif method == "mfp":
+                peaks = [refine_peak(beam, [ycoord, xcoord, zcoord, vel], method=refine) \
+                        for beam in beams]
+                vels = [peak[0][3] for peak in peaks]
+                xepi = [peak[0][1] for peak in peaks]
+                yepi = [peak[0][0] for peak in peaks]
+                zhyp = [peak[0][2] for peak in peaks]
+            pows = [peak[1] for peak in peaks]
+        else:
+            # locally tracked beams are nan outside of the tracked neighbourhood,
+            # beams without finite values are removed below
+            pows = [np.nanmax(beam) if np.isfinite(beam).any() else np.nan \
+                    for beam in beams]
+            inds_max = [np.unravel_index(np.nanargmax(beam), beam.shape) \
+                    if np.isfinite(pow) else (0,) * beam.ndim \
+                    for beam, pow in zip(beams, pows)]
+            if method == "plw":
+                vels = [vel[ind[0]] for ind in inds_max]
+                bazs = [baz[ind[1]] for ind in inds_max]
+            elif method == "mfp":
+                vels = [vel[ind[3]] for ind in inds_max]
+                xepi = [xcoord[ind[1]] for ind in inds_max]
+                yepi = [ycoord[ind[0]] for ind in inds_max]
+                zhyp = [zcoord[ind[2]] for ind in inds_max]
+
+        # strongest separated maxima
+        if npeaks is not None:
+            peaks = np.empty(len(beams), dtype=object)
+            for i, beam in enumerate(beams):
+                if method == "plw":
+                    pks = find_peaks(beam, [vel, baz], npeaks, [None, 360.], nbh)
+                    peaks[i] = np.column_stack((pks[:, 1] % 360, pks[:, 0], pks[:, 2]))
+                elif method == "mfp":
+                    pks = find_peaks(beam, [ycoord, xcoord, zcoord, vel], npeaks, nbh=nbh)
+                    peaks[i] = pks[:, [1, 0, 2, 3, 4]]
 
         # remove nans
         ind = np.where(np.isnan(pows) == False)[0]
@@ -149,6 +194,8 @@ def load_beams(fn, method, t1=None, t2=None, powmin=0, slowness=None):
         pows = pows[ind]
         times = np.array(times)[ind]
         vels = np.array(vels)[ind]
+        if npeaks is not None:
+            peaks = peaks[ind]
         if method == "plw":
             bazs = np.array(bazs)[ind]
         elif method == "mfp":
@@ -162,6 +209,8 @@ def load_beams(fn, method, t1=None, t2=None, powmin=0, slowness=None):
             pows = pows[ind]
             times = times[ind]
             vels = vels[ind]
+            if npeaks is not None:
+                peaks = peaks[ind]
             if method == "plw":
                 bazs = bazs[ind]
             elif method == "mfp":
@@ -174,6 +223,8 @@ def load_beams(fn, method, t1=None, t2=None, powmin=0, slowness=None):
         pows = pows[ind] 
         times = times[ind]
         vels = vels[ind]
+        if npeaks is not None:
+            peaks = peaks[ind]
         if method == "plw":
             bazs = bazs[ind]
         elif method == "mfp":
@@ -182,9 +233,14 @@ def load_beams(fn, method, t1=None, t2=None, powmin=0, slowness=None):
             zhyp = zhyp[ind]
 
         if method == "plw":
-            return times, bazs, vels, pows
+            res = [times, bazs, vels, pows]
         elif method == "mfp":
-            return times, [xepi, yepi, zhyp], vels, pows
+            res = [times, [xepi, yepi, zhyp], vels, pows]
+        if npeaks is not None:
+            res.append(list(peaks))
+        return tuple(res)
 
     except:
+        if npeaks is not None:
+            return None, None, None, None, None
         return None, None, None, None
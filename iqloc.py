@@ -1,19 +1,251 @@
 import numpy as np
 from obspy import read, Stream, UTCDateTime
-from obspy.signal.trigger import classic_sta_lta, plot_trigger, trigger_onset
+from obspy.signal.trigger import plot_trigger
 import obspy.signal
-from glseis.array_analysis import plwave_beamformer, matchedfield_beamformer
+from glseis.array_analysis import plwave_beamformer, matchedfield_beamformer, delaysum_beamformer, auto_grid
+from glseis.array_analysis import plwave_beamformer_batch, beampower_detector, find_peaks
+from glseis.mseed_index import read_mseed_window
 from collections import OrderedDict
 import warnings
 import matplotlib.pyplot as plt
 import matplotlib.image as mpimg
 import matplotlib.patches as patches
+from joblib import Parallel, delayed, effective_n_jobs
+from joblib.externals.loky import get_reusable_executor
 import glob
 import os
 import sys
 
 
 
+def classic_sta_lta_2d(data, nsta, nlta):
+    """
+    Classic STA/LTA of several traces at once (same as obspy.signal.trigger.classic_sta_lta_py for each row),
+    using cumulative sums along the time axis.
+    :param data: traces (dim: [number of traces, number of samples])
+    :param nsta: number of samples short term average
+    :param nlta: number of samples long term average
+    :return: characteristic functions (dim: [number of traces, number of samples])
+    """
+    sta = np.cumsum(np.asarray(data, dtype=np.float64) ** 2, axis=1)
+    lta = sta.copy()
+    sta[:, nsta:] = sta[:, nsta:] - sta[:, :-nsta]
+    sta /= nsta
+    lta[:, nlta:] = lta[:, nlta:] - lta[:, :-nlta]
+    lta /= nlta
+    sta[:, :nlta - 1] = 0
+    # avoid division by zero
+    dtiny = np.finfo(0.0).tiny
+    lta[lta < dtiny] = dtiny
+    sta /= lta
+    return sta
+
+
+def trigger_onset_2d(cft, thrsh1, thrsh2):
+    """
+    Trigger on/off samples of several characteristic functions at once, without loops over samples (same result as
+    obspy.signal.trigger.trigger_onset for each row). A trigger starts where the characteristic function reaches
+    thrsh1 and ends at the last sample before it drops below thrsh2.
+    :param cft: characteristic functions (dim: [number of traces, number of samples])
+    :param thrsh1: threshold to trigger
+    :param thrsh2: threshold to stop trigger
+    :return: list with on/off samples of the triggers of each trace (each dim: [number of triggers, 2])
+    """
+    ntr, npts = cft.shape
+    pad = np.zeros((ntr, 1), dtype=np.int8)
+    # starts of runs above thrsh1
+    r_on, c_on = np.nonzero(np.diff(np.hstack((pad, (cft >= thrsh1).astype(np.int8))), axis=1) == 1)
+    # ends of runs above thrsh2, and end of each trace
+    r_of, c_of = np.nonzero(np.diff(np.hstack(((cft >= thrsh2).astype(np.int8), pad)), axis=1) == -1)
+    r_of = np.concatenate((r_of, np.arange(ntr)))
+    c_of = np.concatenate((c_of, np.full(ntr, npts)))
+    # sort candidates of all traces along one axis
+    key_on = r_on * (npts + 1) + c_on
+    key_of = np.sort(r_of * (npts + 1) + c_of)
+    # each trigger ends at the first off candidate after its start, further starts before this end are skipped
+    key_end = key_of[np.searchsorted(key_of, key_on)]
+    keep = np.ones(key_on.size, dtype=bool)
+    keep[1:] = key_end[1:] != key_end[:-1]
+    trig = np.column_stack((c_on[keep], key_end[keep] - r_on[keep] * (npts + 1))).astype(np.int64)
+    return np.split(trig, np.searchsorted(r_on[keep], np.arange(1, ntr)))
+
+
+
+def trigger_traces(traces, nsta, nlta, thrsh1, thrsh2):
+    """
+    Classic STA/LTA triggering of several traces in a single pass (see classic_sta_lta_2d and trigger_onset_2d). The
+    traces are zero padded to a common length, the characteristic function of the padded samples is set to zero.
+    :param traces: list of obspy trace objects
+    :param nsta: number of samples short term average
+    :param nlta: number of samples long term average
+    :param thrsh1: nsta/nlta threshold to trigger
+    :param thrsh2: nsta/nlta threshold to stop trigger
+    :return: characteristic functions (dim: [number of traces, max. number of samples]) and list with on/off samples
+        of the triggers of each trace (each dim: [number of triggers, 2])
+    """
+    npts = np.array([tr.stats.npts for tr in traces])
+    data = np.zeros((len(traces), npts.max()))
+    for i, tr in enumerate(traces):
+        data[i, :npts[i]] = tr.data
+    cft = classic_sta_lta_2d(data, nsta, nlta)
+    del data
+    cft[np.arange(cft.shape[1]) >= npts[:, np.newaxis]] = 0.
+    return cft, trigger_onset_2d(cft, thrsh1, thrsh2)
+
+
+
+def associate_onsets(ons, tt, narr):
+    """
+    Associate events detected on several arrays by their trigger on times. Each event of a reference array (all
+    arrays but the last) is associated with the event of each other array, if exactly one event of that array is
+    triggered within +-tt. Windowing is done with searchsorted on sorted on times, i.e. O(n log n) in the number of
+    events.
+    :param ons: list containing the trigger on times (timestamps) of the events of each array
+    :param tt: maximum difference of trigger on times (travel time between arrays)
+    :param narr: minimum number of arrays an associated event has to be detected on
+    :return: indices of the events of each array forming associated events, -1 if not detected on array
+        (dim: [number of associated events, number of arrays])
+    """
+    n_arr = len(ons)
+    # sort on times of each array once
+    perm = [np.argsort(on, kind="stable") for on in ons]
+    ons_sorted = [on[p] for on, p in zip(ons, perm)]
+    assoc = [np.zeros((0, n_arr), dtype=np.int64)]
+    for i in range(n_arr - 1):
+        on = ons[i]
+        match = np.full((on.size, n_arr), -1, dtype=np.int64)
+        match[:, i] = np.arange(on.size)
+        for k in range(n_arr):
+            if k == i:
+                continue
+            # events of array k within (on-tt, on+tt)
+            lo = np.searchsorted(ons_sorted[k], on - tt, side="right")
+            hi = np.searchsorted(ons_sorted[k], on + tt, side="left")
+            one = (hi - lo) == 1
+            match[one, k] = perm[k][lo[one]]
+        assoc.append(match[(match >= 0).sum(axis=1) >= narr])
+    assoc = np.vstack(assoc)
+
+    # delete multiple entries (keep last occurrence)
+    last = {}
+    for j, row in enumerate(map(tuple, assoc)):
+        last[row] = j
+    return assoc[np.sort(np.array(list(last.values()), dtype=np.int64))]
+
+
+
+class station_day_cache():
+    """
+    In-memory cache of decoded miniSEED files (station days) with a memory cap and least recently used eviction.
+    Each file is decoded only once, time windows are served as copies of slices of the cached data. Optionally, time
+    windows of files which are not cached are read with a record index (see mseed_index), decoding only the records
+    covering the window. When pickled (e.g. for worker processes), the cache is replaced by the cache of the
+    receiving process (see process_cache), i.e. each worker process decodes a file at most once. Worker caches belong
+    to a run (see start_run), all worker caches of a run together occupy at most max_bytes.
+    """
+
+
+    def __init__(self, max_bytes=2.e9, use_index=False):
+        """
+        Initialize class station_day_cache.
+        :param max_bytes: maximum memory (in bytes) occupied by the cached data
+        :param use_index: if True, time windows of files which are not cached are read with the record index
+        """
+        self.max_bytes = max_bytes
+        self.use_index = use_index
+        self.streams = OrderedDict()
+        self.nbytes = 0
+        self.run = None
+        self.worker_bytes = max_bytes
+
+
+    def __reduce__(self):
+        # cached data are not passed on when pickled for worker processes, instead each worker process keeps its own
+        # cache for all tasks of the current run it handles
+        return process_cache, (self.worker_bytes, self.use_index, self.run)
+
+
+    def start_run(self, n_jobs):
+        """
+        Start a new run of worker processes. Worker caches of earlier runs are not used anymore, and max_bytes is
+        split among the workers.
+        :param n_jobs: number of worker processes (as passed to joblib.Parallel)
+        """
+        self.run = os.urandom(8).hex()
+        self.worker_bytes = self.max_bytes / effective_n_jobs(n_jobs)
+
+
+    def read(self, fn, starttime=None, endtime=None):
+        """
+        Read data like obspy.read, but from the cache if the file has been read before.
+        :param fn: file name (wildcards allowed)
+        :param starttime: if given, only data after starttime are returned
+        :param endtime: if given, only data before endtime are returned
+        :return: obspy stream object (copy of the cached data)
+        """
+        if fn in self.streams:
+            self.streams.move_to_end(fn)
+            st = self.streams[fn]
+        elif self.use_index and (starttime is not None or endtime is not None):
+            # decode only the records covering the window, without caching
+            if starttime is None:
+                starttime = UTCDateTime(0)
+            if endtime is None:
+                endtime = UTCDateTime(2 ** 31)
+            return read_mseed_window(fn, starttime, endtime)
+        else:
+            st = read(fn)
+            station_day_cache.insert(self, fn, st)
+        if starttime is None and endtime is None:
+            return st.copy()
+        return st.slice(starttime, endtime, nearest_sample=True).copy()
+
+
+    def insert(self, fn, st):
+        """
+        Add decoded data of a file to the cache (e.g. data decoded in a worker process).
+        :param fn: file name
+        :param st: obspy stream object containing the complete data of the file
+        """
+        if fn in self.streams:
+            self.nbytes -= sum([tr.data.nbytes for tr in self.streams.pop(fn)])
+        self.streams[fn] = st
+        self.nbytes += sum([tr.data.nbytes for tr in st])
+        # evict least recently used files (but keep the current one)
+        while self.nbytes > self.max_bytes and len(self.streams) > 1:
+            _, st_old = self.streams.popitem(last=False)
+            self.nbytes -= sum([tr.data.nbytes for tr in st_old])
+
+
+
+# caches of the current process, used for caches received from other processes (see station_day_cache)
+process_caches = {}
+
+
+def process_cache(max_bytes, use_index, run=None):
+    """
+    Returns the station day cache of the current process with the given settings, created on first use. Caches of
+    other runs are dropped.
+    :param max_bytes: maximum memory (in bytes) occupied by the cached data
+    :param use_index: if True, time windows of files which are not cached are read with the record index
+    :param run: run the cache belongs to (see station_day_cache.start_run)
+    """
+    key = (max_bytes, use_index, run)
+    if key not in process_caches:
+        for key_ in [key_ for key_ in process_caches if key_[2] != run]:
+            del process_caches[key_]
+        process_caches[key] = station_day_cache(max_bytes, use_index)
+    return process_caches[key]
+
+
+def release_worker_caches():
+    """
+    Shuts down the (reusable) worker processes of the loky backend, which frees the memory of their caches.
+    """
+    get_reusable_executor().shutdown(wait=True)
+
+
+
 class icequake_locations():
     """
     Class to locate icequakes using beamforming and triangulation.
@@ -21,7 +253,7 @@ class icequake_locations():
 
 
     def __init__(self, path2mseed, path2DBs, array, r, stnlist, chn,
-                 sens, jday, fs, decfact, fmin, fmax, vmin, vmax, dv):
+                 sens, jday, fs, decfact, fmin, fmax, vmin, vmax, dv, cache_size=2.e9, use_index=False):
         """
         Initialize class icequake_locations.
         :param path2mseed: path to mseed data
@@ -39,6 +271,9 @@ class icequake_locations():
         :param vmin: min velocity used for beamforming
         :param vmax: max velocity used for beamforming
         :param dv: velocity step used for beamforming
+        :param cache_size: maximum memory (in bytes) used to keep decoded station days in memory
+        :param use_index: if True, time windows of station days which are not in memory are read via a record index
+            stored next to the miniSEED files (see mseed_index)
         """
         self.path2mseed = path2mseed
         self.path2DBs = path2DBs
@@ -55,12 +290,27 @@ class icequake_locations():
         self.vmin = vmin
         self.vmax = vmax
         self.dv = dv
+        self.cache = station_day_cache(cache_size, use_index)
 
 
-    def make_eventDB_header(self, fh):
+    def station_day_file(self, stn):
+        """
+        Returns the miniSEED file name of a station for the julian day of consideration. All station days are read
+        via this name, so that each is decoded and cached only once. The julian day is not zero padded (e.g.
+        4D.PM15..GP1.D.2016.5); if no such file exists, the zero padded name (4D.PM15..GP1.D.2016.005) is used.
+        :param stn: station name
+        """
+        fn = self.path2mseed + "%s/%s.D/4D.%s..%s.D.2016." % (stn, self.chn, stn, self.chn)
+        if not os.path.isfile(fn + "%i" % self.jday) and os.path.isfile(fn + "%03d" % self.jday):
+            return fn + "%03d" % self.jday
+        return fn + "%i" % self.jday
+
+
+    def make_eventDB_header(self, fh, npeaks=None):
         """
         Write eventDB header.
         :param fh: already open file (write access)
+        :param npeaks: if given, the entries contain baz, vel and pow of npeaks beam maxima
         """
         fh.write("BEAMFORMING PARAMETERS:\n")
         fh.write("fmin: %.1f\n" % self.fmin)
@@ -68,11 +318,16 @@ class icequake_locations():
         fh.write("vmin: %.3f\n" % self.vmin)
         fh.write("vmax: %.3f\n" % self.vmax)
         fh.write("dv: %.3f\n" % self.dv)
-        fh.write("RESULTS (ID, t1, t2, peak ampl., peak freq., trigger duration, average delay, baz max pow, vel max pow, max pow):\n")
+        if npeaks is not None and npeaks > 1:
+            fh.write("RESULTS (ID, t1, t2, peak ampl., peak freq., trigger duration, average delay, baz max pow, vel max pow, max pow, "
+                     "(baz, vel, pow) of maxima 2-%i):\n" % npeaks)
+        else:
+            fh.write("RESULTS (ID, t1, t2, peak ampl., peak freq., trigger duration, average delay, baz max pow, vel max pow, max pow):\n")
         fh.flush()
 
 
-    def make_eventDB_entry(self, fh, n, t1, t2, pampl, pfreq, dur, avg_delay, baz, slow, beam):
+    def make_eventDB_entry(self, fh, n, t1, t2, pampl, pfreq, dur, avg_delay, baz, slow, beam, peak=None,
+                           npeaks=None, nbh=1):
         """
         Make eventDB entry for an event.
         :param fh: already open file (write access)
@@ -86,19 +341,41 @@ class icequake_locations():
         :param baz: determined back azimuth
         :param slow: determined (average) slowness in array
         :param beam: beam power
+        :param peak: refined beam maximum (baz, slowness, beam power) as returned by plwave_beamformer. If given,
+            it is used instead of the grid maximum of beam.
+        :param npeaks: if given, baz, vel and pow of the 2nd to npeaks-th strongest separated beam maxima (see
+            array_analysis.find_peaks) are appended to the entry (nan if there are less maxima).
+        :param nbh: minimum separation of the maxima in grid points (slowness, baz), see array_analysis.find_peaks
         """
         id = "%03d_%s_%04d" % (self.jday, self.array, n)
         try:
-            ind_baz = np.argmax(np.amax(beam, axis=0))
-            ind_slow = np.argmax(np.amax(beam, axis=1))
-            max_pow = beam[ind_slow,ind_baz]
-            max_slow = slow[ind_slow]
-            max_baz = baz[ind_baz]
-            line = "%s   %s   %s   %.2e   %05.1f   %.3f   %06.3f   %3i   %06.3f   %.3f\n" % (id, t1, t2, pampl, pfreq,
-                                                                        dur, avg_delay, max_baz, 1./max_slow, max_pow)
+            if peak is not None:
+                max_baz, max_slow, max_pow = peak
+                fmt_baz = "%5.1f"
+            else:
+                ind_baz = np.argmax(np.amax(beam, axis=0))
+                ind_slow = np.argmax(np.amax(beam, axis=1))
+                max_pow = beam[ind_slow,ind_baz]
+                max_slow = slow[ind_slow]
+                max_baz = baz[ind_baz]
+                fmt_baz = "%3i"
+            line = ("%s   %s   %s   %.2e   %05.1f   %.3f   %06.3f   " + fmt_baz + "   %06.3f   %.3f") % (id, t1, t2,
+                                                    pampl, pfreq, dur, avg_delay, max_baz, 1./max_slow, max_pow)
+            # secondary maxima
+            if npeaks is not None and npeaks > 1:
+                pks = find_peaks(beam, [slow, baz], npeaks, [None, 360.], nbh)[1:]
+                for i in range(npeaks - 1):
+                    if i < pks.shape[0]:
+                        line += "   %3i   %06.3f   %.3f" % (pks[i, 1] % 360, 1./pks[i, 0], pks[i, 2])
+                    else:
+                        line += "   %3s   %6s   %5s" % (np.nan, np.nan, np.nan)
+            line += "\n"
         except:
-            line = "%s   %s   %s   %.2e   %05.1f   %.3f   %06.3f   %3s   %6s   %5s\n" % (id, t1, t2, pampl, pfreq, dur,
-                                                                        avg_delay, np.nan, np.nan, np.nan)
+            line = "%s   %s   %s   %.2e   %05.1f   %.3f   %06.3f   %3s   %6s   %5s" % (id, t1, t2, pampl, pfreq, dur,
+                                                                      avg_delay, np.nan, np.nan, np.nan)
+            if npeaks is not None and npeaks > 1:
+                line += "   %3s   %6s   %5s" % (np.nan, np.nan, np.nan) * (npeaks - 1)
+            line += "\n"
             pass
         fh.write(line)
         fh.flush()
@@ -249,9 +526,8 @@ class icequake_locations():
         st = Stream()
         for arr in arrays:
             ind_arr = int(arr[1])
-            st += read(self.path2mseed + "PM%i5/%s.D/4D.PM%i5..%s.D.2016.%03d" % (ind_arr, self.chn, ind_arr,
-                                                                                  self.chn, self.jday),
-                       starttime=t1 - 5, endtime=t2 + 5)
+            st += self.cache.read(icequake_locations.station_day_file(self, "PM%i5" % ind_arr),
+                                  starttime=t1 - 5, endtime=t2 + 5)
         # adjust sampling rate
         for tr in st:
             if tr.stats.sampling_rate != self.fs:
@@ -381,7 +657,143 @@ class icequake_locations():
         plt.close()
 
 
-    def trigger_events(self, ftmin, ftmax, nsta, nlta, thrsh1, thrsh2, num_trig, plot=True):
+    def preprocess_station(self, stn, ftmin, ftmax):
+        """
+        Function to read and preprocess (resample, decimate, trim, filter) the continuous data of a station for
+        triggering.
+        :param stn: station name
+        :param ftmin: lower corner frequency used for filtering prior to triggering
+        :param ftmax: upper corner frequency used for filtering prior to triggering
+        :return: obspy stream object. None if there is no data for the station.
+        """
+        # read data
+        try:
+            st = self.cache.read(icequake_locations.station_day_file(self, stn))
+        except:
+            print("%s: no data!!!" % stn)
+            return None
+        # adjust sampling rate
+        for tr in st:
+            if tr.stats.sampling_rate != self.fs:
+                tr.resample(self.fs)
+        if self.decfact > 1:
+            st.decimate(self.decfact)
+        # trim and filter
+        t1 = UTCDateTime(2016, 1, 1)
+        t1.julday = self.jday
+        t2 = t1 + 24. * 60. * 60.
+        st.trim(t1, t2)
+        st.filter("bandpass", freqmin=ftmin, freqmax=ftmax, zerophase=True)
+        return st
+
+
+
+    def trigger_station(self, stn, ftmin, ftmax, nsta, nlta, thrsh1, thrsh2, plot=False, return_data=False):
+        """
+        Function to trigger events on the continuous data of a single station (used by trigger_events in worker
+        processes).
+        :param stn: station name
+        :param ftmin: lower corner frequency used for filtering prior to triggering
+        :param ftmax: upper corner frequency used for filtering prior to triggering
+        :param nsta: number of samples short term average
+        :param nlta: number of samples long term average
+        :param thrsh1: nsta/nlta threshold to trigger
+        :param thrsh2: nsta/nlta threshold to stop trigger
+        :param plot: if true, plots the characteristic function of each trace
+        :param return_data: if true, the decoded station day is returned as well (to fill the cache of the parent
+            process when run in a worker process)
+        :return: on/off times (as timestamps) of triggered events (dim: [number of events, 2]) and times of the
+            envelope maxima (as timestamps), and the decoded station day if return_data is true. None if there is no
+            data for the station.
+        """
+        st = icequake_locations.preprocess_station(self, stn, ftmin, ftmax)
+        if st is None:
+            return None
+        cft, trigs = trigger_traces(st, nsta, nlta, thrsh1, thrsh2)
+        res = icequake_locations.refine_triggers(self, stn, st, cft, trigs, thrsh1, thrsh2, plot)
+        if return_data:
+            fn = icequake_locations.station_day_file(self, stn)
+            return res + (self.cache.streams.get(fn),)
+        return res
+
+
+
+    def refine_triggers(self, stn, st, cft, trigs, thrsh1, thrsh2, plot=False):
+        """
+        Function to convert the triggers of a station to on/off times, to remove multiple triggers and to recalculate
+        the on/off times from the envelope of the events.
+        :param stn: station name
+        :param st: preprocessed data of station (see preprocess_station)
+        :param cft: characteristic functions of the traces of st (see trigger_traces)
+        :param trigs: on/off samples of the triggers of the traces of st (see trigger_traces)
+        :param thrsh1: nsta/nlta threshold to trigger
+        :param thrsh2: nsta/nlta threshold to stop trigger
+        :param plot: if true, plots the characteristic function of each trace
+        :return: on/off times (as timestamps) of triggered events (dim: [number of events, 2]) and times of the
+            envelope maxima (as timestamps)
+        """
+        dt = st[0].stats.delta
+        # convert trigger samples of all traces to timestamps
+        ons = []
+        offs = []
+        for i, tr in enumerate(st):
+            if plot:
+                plot_trigger(tr, cft[i, :tr.stats.npts], thrsh1, thrsh2)
+            ons.append(trigs[i][:,0] * dt + tr.stats.starttime.timestamp)
+            offs.append(trigs[i][:,1] * dt + tr.stats.starttime.timestamp)
+        ons = np.concatenate(ons)
+        offs = np.concatenate(offs)
+
+        # remove events which are triggered within one second after an event
+        tt = 3.
+        ind_del = []
+        for i in range(len(ons) - 1):
+            print(ons[i+1] - ons[i])
+            if (ons[i+1] - ons[i]) < tt:
+                ind_del.append(i+1)
+        ons = np.delete(ons, ind_del)
+        offs = np.delete(offs, ind_del)
+        print("%s: %i events detected!" % (stn, len(ons)))
+
+        # recalculate on/off times (defined as the interval where the envelope is greater than 0.2 times its max)
+        n = 0.4
+        p = 0.6
+        env_maxs = np.zeros(len(ons))
+        for i in range(len(ons)):
+            ts = UTCDateTime(ons[i]) - n
+            te = UTCDateTime(offs[i]) + p
+            st_ = self.cache.read(icequake_locations.station_day_file(self, stn), starttime=ts-5, endtime=te+5)
+            # adjust sampling rate
+            for tr in st_:
+                if tr.stats.sampling_rate != self.fs:
+                    tr.resample(self.fs)
+            st_.filter("bandpass", freqmin=self.fmin, freqmax=self.fmax, zerophase=True)
+            st_.trim(ts, te)
+            # calc envelope
+            env = obspy.signal.filter.envelope(st_[0].data)
+            env_max = np.max(env)
+            env_maxs[i] = ts.timestamp + np.argmax(env) * dt
+            ind_greater = np.where(env >= 0.2*env_max)[0]
+            ediff = np.ediff1d(ind_greater)
+            ind_greater = np.split(ind_greater, np.where(ediff != 1)[0] + 1)
+
+            for j in range(len(ind_greater)):
+                if np.argmax(env) in ind_greater[j]:
+                    ons[i] = ts.timestamp + ind_greater[j][0]*dt
+                    offs[i] = ts.timestamp + ind_greater[j][-1]*dt
+                    #plt.plot(st_[0].data)
+                    #plt.plot(env, "k:")
+                    #plt.plot(ind_greater[j], env[ind_greater[j]], "r")
+                    #plt.show()
+        on_off_ = np.zeros((len(ons),2))
+        on_off_[:,0] = ons
+        on_off_[:,1] = offs
+
+        return on_off_, env_maxs
+
+
+
+    def trigger_events(self, ftmin, ftmax, nsta, nlta, thrsh1, thrsh2, num_trig, plot=True, n_jobs=1):
         """
         Function to trigger events from continuous data.
         :param ftmin: lower corner frequency used for filtering prior to triggering
@@ -391,7 +803,10 @@ class icequake_locations():
         :param thrsh1: nsta/nlta threshold to trigger
         :param thrsh2: nsta/nlta threshold to stop trigger
         :param num_trig: number of stations required to eventually trigger an event
-        :param plot: if true, gives an overview of triggered events
+        :param plot: if true, gives an overview of triggered events (only for n_jobs=1)
+        :param n_jobs: number of processes triggering the stations in parallel, -1 uses all CPUs. For n_jobs=1, the
+            stations are triggered one after another (the sta/lta of all traces of a station in a single pass), so
+            that only the data of one station are held in memory.
         """
         print("TRIGGER EVENTS ...")
         print("STA: %i samples" % nsta)
@@ -399,99 +814,35 @@ class icequake_locations():
         print("-------------------------------------------------")
 
         # trigger on continuous data from all array stations
+        if n_jobs == 1:
+            res = []
+            for stn in self.stnlist:
+                st = icequake_locations.preprocess_station(self, stn, ftmin, ftmax)
+                if st is None:
+                    print("skip this day!")
+                    sys.exit(1)
+                # sta/lta of all traces of the station in a single pass
+                cft, trigs = trigger_traces(st.traces, nsta, nlta, thrsh1, thrsh2)
+                res.append(icequake_locations.refine_triggers(self, stn, st, cft, trigs, thrsh1, thrsh2, plot))
+                del st, cft, trigs
+        else:
+            station_day_cache.start_run(self.cache, n_jobs)
+            res = Parallel(n_jobs=n_jobs, backend="loky")(delayed(icequake_locations.trigger_station)\
+                (self, stn, ftmin, ftmax, nsta, nlta, thrsh1, thrsh2, return_data=True) for stn in self.stnlist)
+            release_worker_caches()
+            # station days decoded by the workers are kept in the cache for later reads
+            for stn, r in zip(self.stnlist, res):
+                if r is not None and r[2] is not None:
+                    self.cache.insert(icequake_locations.station_day_file(self, stn), r[2])
+            res = [r[:2] if r is not None else None for r in res]
+        # merge trigger times and envelope maxima of all stations
         trig_times = {}
         dict_env_maxs = {}
-        # read data
-        for stn in self.stnlist:
-            try:
-                st = read(self.path2mseed + "%s/%s.D/4D.%s..%s.D.2016.%i" % (stn, self.chn, stn, self.chn, self.jday))
-            except:
-                print("%s: no data!!!" % stn)
+        for stn, r in zip(self.stnlist, res):
+            if r is None:
                 print("skip this day!")
                 sys.exit(1)
-            # adjust sampling rate
-            for tr in st:
-                if tr.stats.sampling_rate != self.fs:
-                    tr.resample(self.fs)
-            if self.decfact > 1:
-                st.decimate(self.decfact)
-            # trim and filter
-            t1 = UTCDateTime(2016, 1, 1)
-            t1.julday = self.jday
-            t2 = t1 + 24. * 60. * 60.
-            st.trim(t1, t2)
-            dt = st[0].stats.delta
-            st.filter("bandpass", freqmin=ftmin, freqmax=ftmax, zerophase=True)
-
-            # for station, trigger all traces and count number of events
-            n_ev = 0
-            for tr in st:
-                cft = classic_sta_lta(tr.data, nsta, nlta)
-                on_off = trigger_onset(cft, thrsh1, thrsh2)
-                if plot:
-                    plot_trigger(tr, cft, thrsh1, thrsh2)
-                if len(on_off) > 0:
-                    n_ev += on_off.shape[0]
-
-            # trigger again and convert trigger time to timestring format
-            ons = np.zeros(n_ev)
-            offs = np.zeros(n_ev)
-            ind = 0
-            for i, tr in enumerate(st):
-                cft = classic_sta_lta(tr.data, nsta, nlta)
-                trig = trigger_onset(cft, thrsh1, thrsh2)
-                if len(trig) > 0:
-                    ons[ind:ind+trig.shape[0]] = trig.astype(float)[:,0] * dt + tr.stats.starttime.timestamp
-                    offs[ind:ind+trig.shape[0]] = trig.astype(float)[:,1] * dt + tr.stats.starttime.timestamp
-                    ind += trig.shape[0]
-
-            # remove events which are triggered within one second after an event
-            tt = 3.
-            ind_del = []
-            for i in range(len(ons) - 1):
-                print(ons[i+1] - ons[i])
-                if (ons[i+1] - ons[i]) < tt:
-                    ind_del.append(i+1)
-            ons = np.delete(ons, ind_del)
-            offs = np.delete(offs, ind_del)
-            print("%s: %i events detected!" % (stn, len(ons)))
-
-            # recalculate on/off times (defined as the interval where the envelope is greater than 0.2 times its max)
-            n = 0.4
-            p = 0.6
-            env_maxs = np.zeros(len(ons))
-            for i in range(len(ons)):
-                ts = UTCDateTime(ons[i]) - n
-                te = UTCDateTime(offs[i]) + p
-                st_ = read(self.path2mseed + "%s/%s.D/4D.%s..%s.D.2016.%i" % (stn, self.chn, stn, self.chn, self.jday),
-                           starttime=ts-5, endtime=te+5)
-                # adjust sampling rate
-                for tr in st_:
-                    if tr.stats.sampling_rate != self.fs:
-                        tr.resample(self.fs)
-                st_.filter("bandpass", freqmin=self.fmin, freqmax=self.fmax, zerophase=True)
-                st_.trim(ts, te)
-                # calc envelope
-                env = obspy.signal.filter.envelope(st_[0].data)
-                env_max = np.max(env)
-                env_maxs[i] = ts.timestamp + np.argmax(env) * dt
-                ind_greater = np.where(env >= 0.2*env_max)[0]
-                ediff = np.ediff1d(ind_greater)
-                ind_greater = np.split(ind_greater, np.where(ediff != 1)[0] + 1)
-
-                for j in range(len(ind_greater)):
-                    if np.argmax(env) in ind_greater[j]:
-                        ons[i] = ts.timestamp + ind_greater[j][0]*dt
-                        offs[i] = ts.timestamp + ind_greater[j][-1]*dt
-                        #plt.plot(st_[0].data)
-                        #plt.plot(env, "k:")
-                        #plt.plot(ind_greater[j], env[ind_greater[j]], "r")
-                        #plt.show()
-            on_off_ = np.zeros((len(ons),2))
-            on_off_[:,0] = ons
-            on_off_[:,1] = offs
-            trig_times[stn] = on_off_
-            dict_env_maxs[stn] = env_maxs
+            trig_times[stn], dict_env_maxs[stn] = r
 
         # take only events which are triggered on at least num_trig stations (take travel time for very slow velocities
         #  across the array radius as limit)
@@ -524,7 +875,257 @@ class icequake_locations():
 
 
 
-    def beamform_icequakes(self, on_off, coords, select_iq=False, show_res=False):
+    def detect_events(self, coords, t_win, t_step, thrsh1, thrsh2, dv=None, dbaz=10, plot=False):
+        """
+        Function to detect events from continuous data with a beam power detector (alternative to trigger_events).
+        A coarse-grid time-domain beamformer runs continuously over the day and triggers on coherent beam power,
+        so that detected events already carry back azimuth and slowness.
+        :param coords: coordinates of array stations (consecutively numbered station name required)
+        :param t_win: length of detection windows in seconds
+        :param t_step: step between detection windows in seconds
+        :param thrsh1: beam power (semblance) threshold to trigger
+        :param thrsh2: beam power (semblance) threshold to stop trigger
+        :param dv: velocity step of the coarse grid. If None, the velocity step used for beamforming is taken
+        :param dbaz: back azimuth step of the coarse grid in degrees
+        :param plot: if true, plots the beam power along with the triggered events
+        :return: on/off times (as timestamps), back azimuth, slowness (s/km) and beam power of detected events
+            (dim: [number of events, 5]). The first two columns can be passed as on_off to beamform_icequakes.
+        """
+        print("DETECT EVENTS ...")
+        print("window: %.2f s, step: %.2f s" % (t_win, t_step))
+        print("-------------------------------------------------")
+        if dv is None:
+            dv = self.dv
+
+        # read data of all array stations
+        t1 = UTCDateTime(2016, 1, 1)
+        t1.julday = self.jday
+        t2 = t1 + 24. * 60. * 60.
+        cont = Stream()
+        for stn in self.stnlist:
+            try:
+                st = self.cache.read(icequake_locations.station_day_file(self, stn))
+            except:
+                print("%s: no data!!!" % stn)
+                print("skip this day!")
+                sys.exit(1)
+            # adjust sampling rate
+            for tr in st:
+                if tr.stats.sampling_rate != self.fs:
+                    tr.resample(self.fs)
+            if self.decfact > 1:
+                st.decimate(self.decfact)
+            st.merge(fill_value=0)
+            cont += st
+        cont.trim(t1, t2, pad=True, fill_value=0)
+        df = cont[0].stats.sampling_rate
+        t0 = cont[0].stats.starttime.timestamp
+
+        # continuous data matrix in the data type of the traces (converted to float blockwise by the detector),
+        # dim: [number of samples, number of stations]
+        npts = min([tr.stats.npts for tr in cont])
+        data = np.zeros((npts, len(self.stnlist)), dtype=np.result_type(*[tr.data for tr in cont]))
+        for i, tr in enumerate(cont):
+            data[:, i] = tr.data[:npts]
+        del cont
+
+        # detect
+        times, beampow, baz, s, events = beampower_detector(data, coords, self.vmin, self.vmax, dv, False,
+                                                            self.fmin, self.fmax, df, t_win, t_step,
+                                                            thrsh1, thrsh2, dbaz=dbaz)
+        events[:, :2] += t0
+        print("--> %i events detected!" % len(events))
+        print("------------------------------------------")
+
+        if plot:
+            plt.plot(times, beampow, "k")
+            for ev in events:
+                plt.axvspan(ev[0] - t0, ev[1] - t0, color="r", alpha=0.3)
+            plt.axhline(thrsh1, color="r", ls=":")
+            plt.axhline(thrsh2, color="b", ls=":")
+            plt.xlabel("seconds after %s" % UTCDateTime(t0))
+            plt.ylabel("beam power")
+            plt.show()
+
+        return events
+
+
+
+    def prepare_event(self, intvl, select_iq=False):
+        """
+        Function to read and preprocess the data of a triggered event. Also calculates the peak frequency, peak
+        amplitude and average delay of the event.
+        :param intvl: trigger on/off time of event
+        :param select_iq: if True, event will be displayed and user can decide, whether event will be further processed
+        :return: dictionary containing event times, peak frequency/amplitude, average delay, data matrix
+            (dim: [number of samples, number of stations]) and beamforming window parameters
+        """
+        # icequake interval
+        dur = intvl[1] - intvl[0]
+        # calc travel time from margin to center of array (use rayleigh wave as slowest phase)
+        tt = self.r / 1600.
+        ts = UTCDateTime(intvl[0] - tt)
+        te = UTCDateTime(intvl[1] + tt)
+        # read and process data
+        cont = Stream()
+        for stn in self.stnlist:
+            cont += self.cache.read(icequake_locations.station_day_file(self, stn), starttime=ts-1, endtime=te+1)
+        if len(cont) < len(self.stnlist):
+            print("only %i stations recorded event - skipped event !" % len(cont))
+            sys.exit(1)
+        # adjust sampling rate
+        for tr in cont:
+            if tr.stats.sampling_rate != self.fs:
+                tr.resample(self.fs)
+        if self.decfact > 1:
+            cont.decimate(self.decfact)
+        df = cont[0].stats.sampling_rate
+        cont.detrend("linear")
+        cont.taper(max_percentage=0.1)
+        cont.filter("highpass", freq=1., zerophase=True)
+        cont_filt = cont.copy()
+        cont_filt.filter("bandpass", freqmin=self.fmin, freqmax=self.fmax, zerophase=True)
+
+        # calc peak frequency and peak amplitude
+        pfreq, pampl = icequake_locations.calc_pfreq_pampl(self, cont)
+        cont_filt.trim(ts, te)
+        cont.trim(ts, te)
+
+        # calc time shifts of seismograms with respect to center station
+        avg_delay = icequake_locations.calc_average_delay(self, cont_filt)
+        #dt = 1. / df
+        #if self.array == "A0":
+        #    thrsh_dt = 4*dt
+        #else:
+        #    thrsh_dt = 1*dt
+        #if abs(avg_delay) > thrsh_dt:
+        #    print("... not located!")
+        #    baz = None
+        #    s = None
+        #    beam = None
+        #    icequake_locations.make_eventDB_entry(self, fh, (k+1), ts, te, pampl, pfreq,
+        #                                          dur, avg_delay, baz, s, beam)
+        #    sys.exit(1)
+
+        # if true, show icequake before applying beamforming
+        if select_iq:
+            all = Stream()
+            for tr in cont:
+                all += tr
+            for tr in cont_filt:
+                tr.stats.network = "4D_"
+                all += tr
+            all.plot(method="full")
+            input_var = str(input("Use this IQ (y/n)?"))
+            if input_var == "n":
+                # force quit
+                sys.exit(1)
+
+        # prepare for beamforming
+        npts = len(cont[0].data)
+        data = np.zeros((npts, len(self.stnlist)))
+        for i, tr in enumerate(cont):
+            if tr.stats.npts != npts:
+                raise ValueError("different number of samples !!!")
+            data[:, i] = tr.data.astype(float)
+        # adjust window length and delay
+        w_frac = 0.85
+        w_length = w_frac * (te - ts)
+        w_delay = (1 - w_frac) * (te - ts) / 10.
+
+        event = {"ts": ts, "te": te, "dur": dur, "pfreq": pfreq, "pampl": pampl, "avg_delay": avg_delay,
+                 "data": data, "fs": df, "w_length": w_length, "w_delay": w_delay}
+        return event
+
+
+    def plot_event_beam(self, n, event, baz, s, beam):
+        """
+        Function to plot (and save) the waveforms and the beamforming result of an event.
+        :param n: event number (consecutively numbered)
+        :param event: event dictionary as returned by prepare_event
+        :param baz: back azimuth values of beam
+        :param s: slowness values of beam
+        :param beam: beam power
+        """
+        data = event["data"]
+        npts = data.shape[0]
+        dt = 1. / event["fs"]
+        fig = plt.figure(figsize=(20,10))
+        ax1 = fig.add_subplot(121)
+        t = np.arange(0, npts*dt, dt)
+        for i in range(len(self.stnlist)):
+            d = data[:, i]
+            d /= abs(data).max()
+            d -= i * 1.5
+            ax1.plot(t, d, "k")
+            ax1.text(t[3], np.mean(d) + 0.3, self.stnlist[i], fontsize=16)
+        ax1.set_xlabel("seconds")
+        ax1.set_yticklabels([])
+        ax1.set_title("starttime: %s" % event["ts"])
+        ax2 = fig.add_subplot(122, projection="polar")
+        ax2.set_theta_direction(-1)
+        ax2.set_theta_zero_location("N")
+        im = ax2.pcolormesh(np.radians(baz), s, beam, cmap="viridis")
+        ind_baz = np.argmax(np.amax(beam, axis=0))
+        ind_slow = np.argmax(np.amax(beam, axis=1))
+        ax2.plot(np.radians(baz[ind_baz]), s[ind_slow], "ko", markersize=2)
+        ax2.set_title("pow = %.3f - vel = %.3f m/s - baz = %i deg"
+                      % (beam.max(), 1./s[ind_slow], baz[ind_baz]))
+        pth = "./%s/%03d/" % (self.array, self.jday)
+        id = "%03d_%s_%04d" % (self.jday, self.array, n)
+        plt.savefig(pth + id, dpi=50)
+        plt.close()
+
+
+    def beamform_event(self, intvl, coords, select_iq=False, prefilter=None, refine=None, beamform=True):
+        """
+        Function to read, preprocess, screen and beamform a single triggered event (used by beamform_icequakes).
+        :param intvl: trigger on/off time of event
+        :param coords: coordinates of array stations (consecutively numbered station name required)
+        :param select_iq: if True, event will be displayed and user can decide, whether event will be further processed
+        :param prefilter: minimum semblance of the time-domain delay-and-sum beamformer (see beamform_icequakes)
+        :param refine: refinement of the beam maximum (see beamform_icequakes)
+        :param beamform: if False, the event is only prepared and screened
+        :return: event dictionary (see prepare_event) with additional entries screened, baz, s, beam and peak
+            (None if not beamformed), and an error message (None if the event was processed successfully)
+        """
+        try:
+            event = icequake_locations.prepare_event(self, intvl, select_iq)
+        except SystemExit:
+            # event skipped while preparing (e.g. missing stations or not selected)
+            return None, "skipped"
+        except Exception as e:
+            return None, "%s: %s" % (type(e).__name__, e)
+        event["baz"], event["s"], event["beam"], event["peak"] = None, None, None, None
+        try:
+            # screen event with time-domain beamformer on coarse grid and decimated data
+            event["screened"] = False
+            if prefilter is not None:
+                dv, dbaz, _ = auto_grid(coords, self.fmax, self.vmin, self.vmax, False)
+                _, _, beam = delaysum_beamformer(event["data"], coords, self.vmin, self.vmax, dv, False,
+                                                 self.fmin, self.fmax, event["fs"], event["w_length"],
+                                                 event["w_delay"], dbaz=dbaz, Fs_screen=8*self.fmax)
+                if beam.max() < prefilter:
+                    print("... max. semblance %.2f below %.2f - not beamformed!" % (beam.max(), prefilter))
+                    event["screened"] = True
+            if not beamform or event["screened"]:
+                return event, None
+
+            # beamforming
+            res = plwave_beamformer(event["data"], coords, self.vmin, self.vmax, self.dv, False,
+                                    self.fmin, self.fmax, event["fs"], event["w_length"],
+                                    event["w_delay"], df=0.25, refine=refine)
+            event["baz"], event["s"], event["beam"] = res[:3]
+            if refine is not None:
+                event["peak"] = res[3]
+        except Exception as e:
+            return None, "%s: %s" % (type(e).__name__, e)
+        return event, None
+
+
+
+    def beamform_icequakes(self, on_off, coords, select_iq=False, show_res=False, prefilter=None, batch=False,
+                           refine=None, npeaks=None, nbh=1, n_jobs=1):
         """
         Function to perform plaine wave beamforming on triggerd event. Also calculates the peak frequency and peak
         amplitude averaged over the array. Writes results to file.
@@ -532,131 +1133,95 @@ class icequake_locations():
         :param coords: coordinates of array stations (consecutively numbered station name required)
         :param select_iq: if True, event will be displayed and user can decide, whether event will be further processed
         :param show_res: if True, beamforming result (along with waveforms) will be plotted and saved.
+        :param prefilter: if not None, events are first screened with the time-domain delay-and-sum beamformer on
+            the coarsest adequate grid (auto_grid) and decimated data. Events whose maximum semblance is below
+            prefilter are not beamformed and are written to the eventDB without beamforming result. The screening
+            is an independent time-domain check of coherence, it does not save computing time.
+        :param batch: if True, all events are read first and then beamformed at once with plwave_beamformer_batch,
+            which sets up grid, replica vectors and DFT matrix only once.
+        :param refine: if "quadratic" or "gaussian", the beam maximum is refined below the grid resolution
+            (see array_analysis.refine_peak) and the refined values are written to the eventDB.
+        :param npeaks: if given, the npeaks strongest separated beam maxima (e.g. of simultaneous sources) are
+            written to the eventDB (see make_eventDB_entry).
+        :param nbh: minimum separation of these maxima in grid points (slowness, baz), see array_analysis.find_peaks
+        :param n_jobs: number of processes handling events in parallel, -1 uses all CPUs. Entries are still written in
+            event order. In batch mode, only reading and screening run in parallel. Ignored if select_iq is True.
         """
         # open file and create header
         path_ = self.path2DBs + "%s/EventDB/" % (self.array)
         if not os.path.exists(path_):
             os.makedirs(path_)
         fh = open(path_ + "%s_EventDB_%03d.txt" % (self.array, self.jday), "w")
-        icequake_locations.make_eventDB_header(self, fh)
+        icequake_locations.make_eventDB_header(self, fh, npeaks)
 
-        # loop over triggered events events
+        # process triggered events, in parallel mode results are returned in event order while workers proceed
         print("BEAMFORM EVENTS ...")
-        for k in range(len(on_off)):
+        if select_iq and n_jobs != 1:
+            print("[INFO] interactive event selection - events are processed sequentially")
+            n_jobs = 1
+        if n_jobs == 1:
+            results = (icequake_locations.beamform_event(self, on_off[k], coords, select_iq, prefilter, refine,
+                                                         not batch) for k in range(len(on_off)))
+        else:
+            station_day_cache.start_run(self.cache, n_jobs)
+            results = Parallel(n_jobs=n_jobs, backend="loky", return_as="generator")(
+                delayed(icequake_locations.beamform_event)(self, on_off[k], coords, False, prefilter, refine,
+                                                           not batch) for k in range(len(on_off)))
+        events = []
+        nfail = 0
+        for k, (event, err) in enumerate(results):
             print("event %i/%i ..." % (k, len(on_off)-1))
-            try:
-                # icequake interval
-                intvl = on_off[k]
-                dur = intvl[1] - intvl[0]
-                # calc travel time from margin to center of array (use rayleigh wave as slowest phase)
-                tt = self.r / 1600.
-                ts = UTCDateTime(intvl[0] - tt)
-                te = UTCDateTime(intvl[1] + tt)
-                # read and process data
-                cont = Stream()
-                for stn in self.stnlist:
-                    cont += read(self.path2mseed + "%s/%s.D/4D.%s..%s.D.2016.%i*" % (stn, self.chn, stn,
-                                 self.chn, self.jday), starttime=ts-1, endtime=te+1)
-                if len(cont) < len(self.stnlist):
-                    print("only %i stations recorded event - skipped event !" % len(cont))
-                    sys.exit(1)
-                # adjust sampling rate
-                for tr in cont:
-                    if tr.stats.sampling_rate != self.fs:
-                        tr.resample(self.fs)
-                if self.decfact > 1:
-                    cont.decimate(self.decfact)
-                df = cont[0].stats.sampling_rate
-                cont.detrend("linear")
-                cont.taper(max_percentage=0.1)
-                cont.filter("highpass", freq=1., zerophase=True)
-                cont_filt = cont.copy()
-                cont_filt.filter("bandpass", freqmin=self.fmin, freqmax=self.fmax, zerophase=True)
-
-                # calc peak frequency and peak amplitude
-                pfreq, pampl = icequake_locations.calc_pfreq_pampl(self, cont)
-                cont_filt.trim(ts, te)
-                cont.trim(ts, te)
-
-                # calc time shifts of seismograms with respect to center station
-                avg_delay = icequake_locations.calc_average_delay(self, cont_filt)
-                #dt = 1. / df
-                #if self.array == "A0":
-                #    thrsh_dt = 4*dt
-                #else:
-                #    thrsh_dt = 1*dt
-                #if abs(avg_delay) > thrsh_dt:
-                #    print("... not located!")
-                #    baz = None
-                #    s = None
-                #    beam = None
-                #    icequake_locations.make_eventDB_entry(self, fh, (k+1), ts, te, pampl, pfreq,
-                #                                          dur, avg_delay, baz, s, beam)
-                #    sys.exit(1)
-
-                # if true, show icequake before applying beamforming
-                if select_iq:
-                    all = Stream()
-                    for tr in cont:
-                        all += tr
-                    for tr in cont_filt:
-                        tr.stats.network = "4D_"
-                        all += tr
-                    all.plot(method="full")
-                    input_var = str(input("Use this IQ (y/n)?"))
-                    if input_var == "n":
-                        # force quit
-                        sys.exit(1)
-
-                # prepare for beamforming
-                npts = len(cont[0].data)
-                data = np.zeros((npts, len(self.stnlist)))
-                for i, tr in enumerate(cont):
-                    if tr.stats.npts != npts:
-                        raise ValueError("different number of samples !!!")
-                    data[:, i] = tr.data.astype(float)
-                # adjust window length and delay
-                w_frac = 0.85
-                w_length = w_frac * (te - ts)
-                w_delay = (1 - w_frac) * (te - ts) / 10.
-
-                # beamforming
-                baz, s, beam = plwave_beamformer(data, coords, self.vmin, self.vmax, self.dv, False, 0,
-                                                 self.fmin, self.fmax, df, w_length, w_delay, df=0.25)
-                # write entry to eventDB 
-                icequake_locations.make_eventDB_entry(self, fh, (k+1), ts, te, pampl, pfreq,
-                                                      dur, avg_delay, baz, s, beam)
-
-                # if true, visualize icequake and beamforming result
-                if show_res:
-                    fig = plt.figure(figsize=(20,10))
-                    ax1 = fig.add_subplot(121)
-                    t = np.arange(0, npts*dt, dt)
-                    for i in range(len(self.stnlist)):
-                        d = data[:, i]
-                        d /= abs(data).max()
-                        d -= i * 1.5
-                        ax1.plot(t, d, "k")
-                        ax1.text(t[3], np.mean(d) + 0.3, self.stnlist[i], fontsize=16)
-                    ax1.set_xlabel("seconds")
-                    ax1.set_yticklabels([])
-                    ax1.set_title("starttime: %s" % ts)
-                    ax2 = fig.add_subplot(122, projection="polar")
-                    ax2.set_theta_direction(-1)
-                    ax2.set_theta_zero_location("N")
-                    im = ax2.pcolormesh(np.radians(baz), s, beam, cmap="viridis")
-                    ind_baz = np.argmax(np.amax(beam, axis=0))
-                    ind_slow = np.argmax(np.amax(beam, axis=1))
-                    ax2.plot(np.radians(baz[ind_baz]), s[ind_slow], "ko", markersize=2)
-                    ax2.set_title("pow = %.3f - vel = %.3f m/s - baz = %i deg"
-                                  % (beam.max(), 1./s[ind_slow], baz[ind_baz]))
-                    pth = "./%s/%03d/" % (self.array, self.jday)
-                    id = "%03d_%s_%04d" % (self.jday, self.array, k+1)
-                    plt.savefig(pth + id, dpi=50)
-                    plt.close()
-            except:
-                pass
+            if err is not None:
+                print("... event %i %s" % (k, err if err == "skipped" else "failed - " + err))
+                nfail += err != "skipped"
+                continue
+            # in batch mode, beamform all events after reading
+            if batch:
+                events.append((k, event))
+                continue
+            # write entry to eventDB
+            icequake_locations.make_eventDB_entry(self, fh, (k+1), event["ts"], event["te"], event["pampl"],
+                                                  event["pfreq"], event["dur"], event["avg_delay"], event["baz"],
+                                                  event["s"], event["beam"], event["peak"], npeaks, nbh)
+            # if true, visualize icequake and beamforming result
+            if show_res and event["beam"] is not None:
+                icequake_locations.plot_event_beam(self, (k+1), event, event["baz"], event["s"], event["beam"])
+
+        # batch mode: beamform all (not screened) events at once and write entries in event order
+        if batch:
+            events_bf = [event for k, event in events if not event["screened"]]
+            baz, s = None, None
+            if len(events_bf) > 0:
+                res = plwave_beamformer_batch([event["data"] for event in events_bf], coords, self.vmin,
+                                              self.vmax, self.dv, False, self.fmin, self.fmax,
+                                              events_bf[0]["fs"],
+                                              [event["w_length"] for event in events_bf],
+                                              [event["w_delay"] for event in events_bf], df=0.25, refine=refine)
+                baz, s, beams = res[:3]
+            i = 0
+            for k, event in events:
+                beam = None
+                peak = None
+                if not event["screened"]:
+                    beam = beams[i]
+                    if refine is not None:
+                        peak = res[3][i]
+                    i += 1
+                    # events which could not be beamformed have nan beams
+                    if np.isnan(beam).all():
+                        print("... event %i failed - not beamformed" % k)
+                        nfail += 1
+                        continue
+                icequake_locations.make_eventDB_entry(self, fh, (k+1), event["ts"], event["te"], event["pampl"],
+                                                      event["pfreq"], event["dur"], event["avg_delay"],
+                                                      baz, s, beam, peak, npeaks, nbh)
+                if show_res and beam is not None:
+                    icequake_locations.plot_event_beam(self, (k+1), event, baz, s, beam)
         fh.close()
+        if n_jobs != 1:
+            release_worker_caches()
+        if nfail > 0:
+            print("[INFO] %i of %i events failed" % (nfail, len(on_off)))
 
 
 
@@ -697,53 +1262,9 @@ class icequake_locations():
         # max travel time: PM35 -> PM05 assume vel=1500 m/s
         tt = 2377. / 1500.
 
-        # prepare for association
-        assoc_iqs = []
-
-        # loop over ons, compare to other ons
-        for i in range(len(ons)-1):
-            on = ons[i]
-            for j in range(on.size):
-                dict_ind = {}
-                dict_ind[arrays[i]] = j
-
-                # select other next on to compare
-                ind_on2_ = i+1
-                if ind_on2_ >= len(ons):
-                    ind_on2_ -= len(ons)
-                ind2 = np.where((on[j]-tt < ons[ind_on2_]) & (ons[ind_on2_] < on[j]+tt))[0]
-                if len(ind2) == 1:
-                    dict_ind[arrays[ind_on2_]] = ind2[0]
-
-                # select second next on to compare
-                if len(dict_cat) > 2:
-                    ind_on3_ = i+2
-                    if ind_on3_ >= len(ons):
-                        ind_on3_ -= len(ons)
-                    ind3 = np.where((on[j]-tt < ons[ind_on3_]) & (ons[ind_on3_] < on[j]+tt))[0]
-                    if len(ind3) == 1:
-                        dict_ind[arrays[ind_on3_]] = ind3[0]
-
-                # select third next on to compare
-                if len(dict_cat) > 3:
-                    ind_on4_ = i+3
-                    if ind_on4_ >= len(ons):
-                        ind_on4_ -= len(ons)
-                    ind4 = np.where((on[j]-tt < ons[ind_on4_]) & (ons[ind_on4_] < on[j]+tt))[0]
-                    if len(ind4) == 1:
-                        dict_ind[arrays[ind_on4_]] = ind4[0]
-
-                # append only to associated event, if dict_ind has at least narr entries
-                if len(dict_ind) >= narr:
-                    assoc_iqs.append(dict_ind)
-
-
-        # delete multiple entries
-        assoc_iqs_ = assoc_iqs
-        assoc_iqs = []
-        for i in range(0, len(assoc_iqs_)):
-            if assoc_iqs_[i] not in assoc_iqs_[i+1:]:
-                assoc_iqs.append(assoc_iqs_[i])
+        # associate events of all arrays
+        assoc = associate_onsets(ons, tt, narr)
+        assoc_iqs = [OrderedDict((arrays[k], row[k]) for k in range(len(arrays)) if row[k] >= 0) for row in assoc]
         print("Associated %i events!" % len(assoc_iqs))
 
         # create dictionary gathering some information for each associated event
@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+"""
+This module contains functions to index miniSEED files on record level and to read short time windows from
+(day-long) files by decoding only the records covering the window.
+"""
+__author__ = "Fabian Lindner"
+
+
+import numpy as np
+import glob
+import io
+import os
+from obspy import read, Stream, UTCDateTime
+from obspy.io.mseed.util import get_record_information
+
+
+# indices of files read in this session, keyed by file name
+mseed_indices = {}
+
+
+def index_file(fn):
+    """
+    Returns the file name of the index belonging to a miniSEED file (hidden file in the same directory, so that it is
+    not matched by wildcards of miniSEED file names).
+    :param fn: file name of miniSEED file
+    """
+    path, name = os.path.split(fn)
+    return os.path.join(path, "." + name + ".idx.npz")
+
+
+def build_mseed_index(fn, save=True):
+    """
+    Scans the headers of all records of a miniSEED file and returns byte offset, length and time span of each record.
+    :param fn: file name of miniSEED file
+    :param save: if True, the index is stored next to the miniSEED file (see index_file)
+    :return: dictionary with arrays offset, reclen (bytes), starttime, endtime (timestamps of first/last sample) and
+        delta (sampling interval) of the records, as well as mtime and size of the indexed file
+    """
+    stat = os.stat(fn)
+    offset = []
+    reclen = []
+    starttime = []
+    endtime = []
+    delta = []
+    with open(fn, "rb") as fh:
+        off = 0
+        while off < stat.st_size:
+            info = get_record_information(fh, offset=off)
+            offset.append(off)
+            reclen.append(info["record_length"])
+            starttime.append(info["starttime"].timestamp)
+            endtime.append(info["endtime"].timestamp)
+            delta.append(1. / info["samp_rate"] if info["samp_rate"] > 0 else 0.)
+            off += info["record_length"]
+    idx = {"offset": np.array(offset, dtype=np.int64), "reclen": np.array(reclen, dtype=np.int64),
+           "starttime": np.array(starttime), "endtime": np.array(endtime), "delta": np.array(delta),
+           "mtime": stat.st_mtime, "size": stat.st_size}
+    if save:
+        try:
+            np.savez(index_file(fn), **idx)
+        except OSError:
+            print("[INFO] could not store index of %s, index is kept in memory only" % fn)
+    return idx
+
+
+def load_mseed_index(fn):
+    """
+    Returns the record index of a miniSEED file. The index is taken from memory or from the index file next to the
+    miniSEED file, and is (re)built if it does not exist or if the miniSEED file changed (mtime/size) since indexing.
+    :param fn: file name of miniSEED file
+    :return: record index (see build_mseed_index)
+    """
+    stat = os.stat(fn)
+    idx = mseed_indices.get(fn)
+    if idx is None and os.path.isfile(index_file(fn)):
+        with np.load(index_file(fn)) as f:
+            idx = dict((key, f[key]) for key in f.files)
+    if idx is None or idx["mtime"] != stat.st_mtime or idx["size"] != stat.st_size:
+        idx = build_mseed_index(fn)
+    mseed_indices[fn] = idx
+    return idx
+
+
+def read_mseed_window(fn, starttime, endtime):
+    """
+    Read the data of a time window from miniSEED files, decoding only the records covering the window.
+    Returns the same as obspy.read(fn).slice(starttime, endtime, nearest_sample=True).
+    :param fn: file name (wildcards allowed)
+    :param starttime: start of time window (UTCDateTime)
+    :param endtime: end of time window (UTCDateTime)
+    :return: obspy stream object
+    """
+    fns = sorted(glob.glob(fn))
+    if len(fns) == 0:
+        raise IOError("no file matching %s" % fn)
+    t1 = UTCDateTime(starttime).timestamp
+    t2 = UTCDateTime(endtime).timestamp
+    st = Stream()
+    for fn_ in fns:
+        idx = load_mseed_index(fn_)
+        # records overlapping the window (one sample margin for nearest sample slicing)
+        ind = np.where((idx["starttime"] - idx["delta"] <= t2) & (idx["endtime"] + idx["delta"] >= t1))[0]
+        if len(ind) == 0:
+            continue
+        buf = io.BytesIO()
+        with open(fn_, "rb") as fh:
+            for i in ind:
+                fh.seek(idx["offset"][i])
+                buf.write(fh.read(idx["reclen"][i]))
+        buf.seek(0)
+        st += read(buf, format="MSEED")
+    return st.slice(UTCDateTime(t1), UTCDateTime(t2), nearest_sample=True)
@@ -0,0 +1,87 @@
+"""Perform beamforming of several arrays in parallel.
+
+This module containes the following functions:
+
+    * beamform_arrays - returns the beams of several arrays for a common time window
+"""
+
+import inspect
+from collections import OrderedDict
+from joblib import Parallel, delayed
+from glseis.array_analysis import plwave_beamformer, matchedfield_beamformer
+from glseis.array_analysis import plwave_setup, matchedfield_setup
+
+
+# setups (grid, delays, DFT matrix and replica vectors) of the arrays beamformed in
+# this session, keyed by method, station coordinates and parameters
+setups = OrderedDict()
+
+
+def array_setup(method, scoord, replicas, maxsize=16, **kwargs):
+    """Return the setup of an array, calculated on first use and cached.
+
+    :param method (str): Beamformer, either "plwave" or "matchedfield".
+    :param scoord (numpy.ndarray): Station coordinates of the array.
+    :param replicas (bool): If True, the setup contains the replica vectors.
+    :param maxsize (int): Number of most recently used setups kept in the cache.
+    :param kwargs: Arguments of the beamformer, those of the setup function
+        (plwave_setup or matchedfield_setup) are used.
+
+    Returns
+        Setup as returned by plwave_setup or matchedfield_setup.
+    """
+    setup_func = plwave_setup if method == "plwave" else matchedfield_setup
+    params = inspect.signature(setup_func).parameters
+    kwargs = dict((key, val) for key, val in kwargs.items() if key in params)
+    key = (method, scoord.tobytes(), scoord.shape, replicas, repr(sorted(kwargs.items())))
+    if key in setups:
+        setups.move_to_end(key)
+        return setups[key]
+    setup = setup_func(scoord, replicas=replicas, **kwargs)
+    setups[key] = setup
+    if len(setups) > maxsize:
+        setups.popitem(last=False)
+    return setup
+
+
+def beamform_arrays(data, scoords, method="plwave", n_jobs=-1, replicas=True, **kwargs):
+    """Beamform the data of several arrays for a common time window concurrently.
+
+    Each array is processed by a separate worker, which computes the DFTs and
+    cross-spectral density matrices of its array. Grid, travel time delays, DFT
+    matrix and replica vectors of each array are calculated once and are kept
+    (see array_setup), so that subsequent time windows of the same arrays reuse
+    them. Processing time of several arrays therefore approaches that of a single
+    array.
+
+    :param data (list): List of time series of the arrays, one numpy.ndarray per
+        array (dim: [number of samples, number of stations of array]).
+    :param scoords (list): List of station coordinates of the arrays, one
+        numpy.ndarray per array (dim: [number of stations of array, 2]).
+    :param method (str): Beamformer, either "plwave" or "matchedfield".
+    :param n_jobs (int): Number of workers, -1 uses all CPUs.
+    :param replicas (bool): If True, the replica vectors of all frequencies are
+        precomputed as well. Use False for grids too large to keep them in memory.
+    :param kwargs: Further arguments of the beamformer (e.g. svmin, svmax, dsv,
+        slow, fmin, fmax, Fs, w_length, w_delay), identical for all arrays.
+
+    Returns
+        List with one entry per array, holding the output of the beamformer.
+    """
+    if method == "plwave":
+        beamformer = plwave_beamformer
+    elif method == "matchedfield":
+        beamformer = matchedfield_beamformer
+    else:
+        raise ValueError("method must be either 'plwave' or 'matchedfield'")
+    if len(data) != len(scoords):
+        raise ValueError("data and scoords must have the same number of arrays")
+
+    # setups of all arrays, passed on to the workers
+    setups_ = [array_setup(method, scoord, replicas, **kwargs) for scoord in scoords]
+
+    # beamform all arrays, results are returned in the order of the arrays
+    res = Parallel(n_jobs=n_jobs, backend="loky")(delayed(beamformer)\
+        (matr, scoord, setup=setup, **kwargs) for matr, scoord, setup in zip(data, scoords, setups_))
+
+    return res
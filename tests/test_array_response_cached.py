@@ -0,0 +1,15 @@
+import numpy as np
+from glseis.array_analysis import array_response_cached
+
+
+def test_response_at_zero_offset():
+    scoord = np.random.default_rng(1).uniform(-300, 300, (9, 2))
+    freq = np.arange(5., 10.25, 0.25)
+    # np.arange(-smax, smax + ds / 2., ds) would not contain zero for these values
+    smax, ds = 0.001, 0.0003
+    sx, response = array_response_cached(scoord, freq, smax, ds)
+    i0 = np.nonzero(sx == 0)[0]
+    assert i0.size == 1
+    assert sx[0] <= -smax and sx[-1] >= smax
+    np.testing.assert_allclose(response[i0[0], i0[0]], 1., rtol=1.e-12)
+    np.testing.assert_allclose(response, response[::-1, ::-1], atol=1.e-12)
@@ -0,0 +1,39 @@
+import numpy as np
+from glseis.array_analysis import plwave_beamformer, matchedfield_beamformer
+from glseis.parallel import beamforming
+from glseis.parallel.beamforming import beamform_arrays
+
+
+def arrays(n_arr=3, n_stats=5, npts=600):
+    rng = np.random.default_rng(1)
+    data = [rng.standard_normal((npts, n_stats)) for i in range(n_arr)]
+    scoords = [rng.uniform(-100, 100, (n_stats, 2)) for i in range(n_arr)]
+    return data, scoords
+
+
+def test_plwave_reuse_gives_identical_beams():
+    data, scoords = arrays()
+    kwargs = dict(svmin=1000., svmax=3000., dsv=100., slow=False, fmin=5., fmax=8., Fs=100., w_length=2.,
+                  w_delay=0.5, refine="quadratic", npeaks=2)
+    res = beamform_arrays(data, scoords, n_jobs=2, **kwargs)
+    nsetups = len(beamforming.setups)
+    # second time window of the same arrays reuses the setups
+    res2 = beamform_arrays([d[::-1] for d in data], scoords, n_jobs=2, **kwargs)
+    assert len(beamforming.setups) == nsetups
+    for i in range(len(data)):
+        for r, d in [(res[i], data[i]), (res2[i], data[i][::-1])]:
+            ref = plwave_beamformer(d, scoords[i], **kwargs)
+            for a, b in zip(r, ref):
+                np.testing.assert_array_equal(a, b)
+
+
+def test_matchedfield_reuse_gives_identical_beams():
+    data, scoords = arrays(n_arr=2)
+    kwargs = dict(xrng=(-100., 100.), yrng=(-100., 100.), zrng=(0., 50.), dx=50., dy=50., dz=25.,
+                  svrng=(1000., 3000.), ds=500., slow=False, fmin=5., fmax=8., Fs=100., w_length=2., w_delay=0.5)
+    for replicas in [True, False]:
+        res = beamform_arrays(data, scoords, method="matchedfield", n_jobs=2, replicas=replicas, **kwargs)
+        for i in range(len(data)):
+            ref = matchedfield_beamformer(data[i], scoords[i], **kwargs)
+            for a, b in zip(res[i], ref):
+                np.testing.assert_array_equal(a, b)
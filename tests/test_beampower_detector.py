@@ -0,0 +1,34 @@
+import numpy as np
+from glseis.array_analysis import beampower_detector
+
+
+def synthetic_day(npts, Fs, scoord, onsets, baz=70., v=2000.):
+    """
+    Noise with plane wave arrivals at the given onsets (seconds).
+    """
+    rng = np.random.default_rng(0)
+    data = rng.standard_normal((npts, scoord.shape[0]))
+    tt = scoord @ np.array([np.sin(np.radians(baz)), np.cos(np.radians(baz))]) / v
+    w = 6. * np.sin(2 * np.pi * 8. * np.arange(200) / Fs) * np.hanning(200)
+    for t0 in onsets:
+        for i in range(scoord.shape[0]):
+            k = int((t0 + tt[i]) * Fs)
+            data[k:k + 200, i] += w
+    return data
+
+
+def test_blockwise_equals_whole_array():
+    Fs = 100.
+    scoord = np.random.default_rng(1).uniform(-300, 300, (9, 2))
+    # arrivals also close to the block boundaries (60 s blocks)
+    data = synthetic_day(int(600 * Fs), Fs, scoord, [100., 179.6, 240.2, 550.])
+    args = (scoord, .5, 3., .25, False, 3., 15., Fs, 1., .5, .4, .3)
+    whole = beampower_detector(data, *args, t_block=None)
+    for t_block in [60., 37.3]:
+        block = beampower_detector(data, *args, t_block=t_block)
+        np.testing.assert_array_equal(block[0], whole[0])
+        np.testing.assert_allclose(block[1], whole[1], rtol=0, atol=1.e-10)
+        np.testing.assert_array_equal(block[2], whole[2])
+        np.testing.assert_array_equal(block[3], whole[3])
+        np.testing.assert_allclose(block[4], whole[4], rtol=0, atol=1.e-10)
+    assert whole[4].shape[0] == 4
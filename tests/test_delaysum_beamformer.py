@@ -0,0 +1,49 @@
+import time
+import numpy as np
+from glseis.array_analysis import plwave_beamformer, delaysum_beamformer, auto_grid
+
+
+def plane_wave(Fs, scoord, dur, baz=70., v=2000.):
+    """
+    Plane wave arrival in noise (time window of dur seconds).
+    """
+    rng = np.random.default_rng(0)
+    tt = scoord @ np.array([np.sin(np.radians(baz)), np.cos(np.radians(baz))]) / v
+    t = np.arange(int(dur * Fs)) / Fs
+    data = 0.3 * rng.standard_normal((t.size, scoord.shape[0]))
+    for i in range(scoord.shape[0]):
+        data[:, i] += np.sin(2 * np.pi * 7. * (t - tt[i])) * np.exp(-((t - tt[i] - dur / 2.) / (dur / 4.))**2)
+    return data
+
+
+def runtime(func, *args, **kwargs):
+    """
+    Best of three runtimes of func in seconds.
+    """
+    times = []
+    for i in range(3):
+        t = time.perf_counter()
+        func(*args, **kwargs)
+        times.append(time.perf_counter() - t)
+    return min(times)
+
+
+def test_screening_grid():
+    Fs = 500.
+    scoord = np.random.default_rng(1).uniform(-300, 300, (9, 2))
+    data = plane_wave(Fs, scoord, 3.)
+    args = (scoord, 1., 3.)
+    dv, dbaz, _ = auto_grid(scoord, 10., 1., 3., False)
+    teta, s, beam = delaysum_beamformer(data, *args, dv, False, 5., 10., Fs, 2.55, 0.045, dbaz=dbaz,
+                                        Fs_screen=80.)
+    teta_, s_, beam_ = plwave_beamformer(data, *args, 0.05, False, 5., 10., Fs, 2.55, 0.045, df=0.25)[:3]
+    i, j = np.unravel_index(np.argmax(beam), beam.shape)
+    i_, j_ = np.unravel_index(np.argmax(beam_), beam_.shape)
+    assert abs((teta[j] - teta_[j_] + 180) % 360 - 180) <= dbaz
+    assert abs(1. / s[i] - 1. / s_[i_]) <= dv
+    # full grid and sampling rate vs. screening
+    t_full = runtime(delaysum_beamformer, data, *args, 0.05, False, 5., 10., Fs, 2.55, 0.045)
+    t_screen = runtime(delaysum_beamformer, data, *args, dv, False, 5., 10., Fs, 2.55, 0.045, dbaz=dbaz,
+                       Fs_screen=80.)
+    assert t_screen < t_full / 4.
+
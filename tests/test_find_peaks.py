@@ -0,0 +1,41 @@
+import io
+import numpy as np
+from glseis.array_analysis import find_peaks
+from glseis.iqloc import icequake_locations
+
+
+def ridge_beam():
+    """
+    Beam with a ridge along back azimuth (slowness in s/km, baz in degrees) with two maxima 4 degrees apart, both
+    of a beam power of 0.257.
+    """
+    s = np.arange(0.3, 1.01, 0.02)
+    baz = np.arange(1., 362., 2.)
+    beam = 0.2 * np.exp(-((s[:, None] - 0.52) / 0.1)**2 - ((baz[None, :] - 147.) / 10.)**2)
+    beam[np.argmin(abs(s - 0.52)), np.argmin(abs(baz - 145.))] = 0.2572
+    beam[np.argmin(abs(s - 0.5)), np.argmin(abs(baz - 149.))] = 0.2568
+    return s, baz, beam
+
+
+def test_ridge_minimum_separation():
+    s, baz, beam = ridge_beam()
+    pks = find_peaks(beam, [s, baz], 2, [None, 360.])
+    assert pks.shape[0] == 2 and sorted(pks[:, 1]) == [145., 149.]
+    # with a separation of 3 grid points (6 degrees), the ridge gives a single maximum
+    for nbh in [3, (3, 3), (1, 3)]:
+        pks = find_peaks(beam, [s, baz], 2, [None, 360.], nbh)
+        assert pks.shape[0] == 1 and pks[0, 1] == 145.
+
+
+def test_eventDB_entry_minimum_separation():
+    s, baz, beam = ridge_beam()
+    iq = icequake_locations.__new__(icequake_locations)
+    iq.jday, iq.array = 10, "A"
+    lines = []
+    for nbh in [1, 3]:
+        fh = io.StringIO()
+        icequake_locations.make_eventDB_entry(iq, fh, 1, 0., 1., 1., 10., 0.5, 0.01, baz, s, beam, npeaks=2,
+                                              nbh=nbh)
+        lines.append(fh.getvalue().split())
+    assert lines[0][-3:] == ["149", "02.000", "0.257"]
+    assert lines[1][-3:] == ["nan", "nan", "nan"]
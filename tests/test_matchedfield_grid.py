@@ -0,0 +1,32 @@
+import numpy as np
+from glseis.array_analysis import matchedfield_grid, matchedfield_params, matchedfield_delays, \
+    matchedfield_beamformer
+
+
+def test_depth_grid_starts_at_zrng():
+    xcoord, ycoord, zcoord, s = matchedfield_grid((0., 100.), (0., 50.), (100., 300.), 50., 50., 100.,
+                                                  (1000., 2000.), 1000., False)
+    np.testing.assert_array_equal(zcoord, [100., 200., 300.])
+    xgrid, ygrid, zgrid, sgrid = matchedfield_params(xcoord, ycoord, zcoord, s)
+    # the first depth level is zrng[0], not z=0
+    np.testing.assert_array_equal(np.unique(zgrid), zcoord)
+    # reshaping with order="F" restores the grid
+    shape = (ycoord.size, xcoord.size, zcoord.size, s.size)
+    for grid, ax, d in [(ygrid, ycoord, 0), (xgrid, xcoord, 1), (zgrid, zcoord, 2), (sgrid, s, 3)]:
+        np.testing.assert_array_equal(np.moveaxis(grid.reshape(shape, order="F"), d, -1)[0, 0, 0], ax)
+
+
+def test_single_depth_beam():
+    rng = np.random.default_rng(1)
+    scoord = rng.uniform(-100, 100, (5, 2))
+    data = rng.standard_normal((600, 5))
+    args = (5., 8., 100., 2., 0.5)
+    # beam focused on a single point at 200 m depth
+    beam = matchedfield_beamformer(data, scoord, (50., 50.), (20., 20.), (200., 200.), 0., 0., 0.,
+                                   (2000., 2000.), 0., False, *args)[4]
+    tau = matchedfield_delays(scoord, np.array([50.]), np.array([20.]), np.array([200.]), np.array([1. / 2000.]))
+    beam0 = matchedfield_beamformer(data, scoord, (50., 50.), (20., 20.), (0., 0.), 0., 0., 0.,
+                                    (2000., 2000.), 0., False, *args)[4]
+    tau0 = matchedfield_delays(scoord, np.array([50.]), np.array([20.]), np.array([0.]), np.array([1. / 2000.]))
+    assert not np.allclose(tau, tau0)
+    assert beam.shape == (1, 1, 1, 1) and not np.isclose(beam.ravel()[0], beam0.ravel()[0])
@@ -0,0 +1,53 @@
+import warnings
+import numpy as np
+from glseis.array_analysis import plwave_beamformer, plwave_beamformer_batch
+
+
+def events(Fs, scoord, durations, baz=70., v=2000.):
+    """
+    Plane wave arrivals in noise, one data matrix per event duration (seconds).
+    """
+    rng = np.random.default_rng(0)
+    tt = scoord @ np.array([np.sin(np.radians(baz)), np.cos(np.radians(baz))]) / v
+    data = []
+    for dur in durations:
+        npts = int((dur + 1.) * Fs)
+        t = np.arange(npts) / Fs
+        d = 0.3 * rng.standard_normal((npts, scoord.shape[0]))
+        for i in range(scoord.shape[0]):
+            d[:, i] += np.sin(2 * np.pi * 7. * (t - tt[i])) * np.exp(-((t - tt[i] - dur / 2.) / (dur / 4.))**2)
+        data.append(d)
+    return data
+
+
+def test_batch_equals_single_events():
+    Fs = 100.
+    scoord = np.random.default_rng(1).uniform(-300, 300, (9, 2))
+    durations = [1.3, 2.77, 4.1]
+    data = events(Fs, scoord, durations)
+    w_length = [0.85 * d for d in durations]
+    w_delay = [0.015 * d for d in durations]
+    args = (scoord, 1., 3., 0.2, False, 5., 10., Fs)
+    _, _, beams = plwave_beamformer_batch(data, *args, w_length, w_delay)
+    for i in range(len(data)):
+        _, _, beam = plwave_beamformer(data[i], *args, w_length[i], w_delay[i])[:3]
+        np.testing.assert_allclose(beams[i], beam, rtol=1.e-12, atol=1.e-14)
+
+
+def test_batch_skips_degenerate_window():
+    Fs = 100.
+    scoord = np.random.default_rng(1).uniform(-300, 300, (9, 2))
+    durations = [1.3, 0.4, 2.77]
+    data = events(Fs, scoord, durations)
+    w_length = [0.85 * d for d in durations]
+    # window delay of less than one sample for the second event
+    w_delay = [0.015, 0.001, 0.04]
+    args = (scoord, 1., 3., 0.2, False, 5., 10., Fs)
+    with warnings.catch_warnings(record=True) as w:
+        warnings.simplefilter("always")
+        _, _, beams, peaks = plwave_beamformer_batch(data, *args, w_length, w_delay, refine="quadratic")
+    assert any("event 1 not beamformed" in str(w_.message) for w_ in w)
+    assert np.isnan(beams[1]).all() and np.isnan(peaks[1]).all()
+    for i in [0, 2]:
+        _, _, beam = plwave_beamformer(data[i], *args, w_length[i], w_delay[i])[:3]
+        np.testing.assert_allclose(beams[i], beam, rtol=1.e-12, atol=1.e-14)
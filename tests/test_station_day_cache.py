@@ -0,0 +1,17 @@
+import pickle
+from glseis import iqloc
+from glseis.iqloc import station_day_cache
+
+
+def test_worker_caches_belong_to_run():
+    cache = station_day_cache(max_bytes=4.e8)
+    station_day_cache.start_run(cache, 4)
+    # caches received by a (worker) process
+    c1 = pickle.loads(pickle.dumps(cache))
+    assert c1 is not cache and c1.max_bytes == 1.e8
+    assert pickle.loads(pickle.dumps(cache)) is c1
+    # a new run does not reuse (possibly stale) caches of the previous run
+    station_day_cache.start_run(cache, 2)
+    c2 = pickle.loads(pickle.dumps(cache))
+    assert c2 is not c1 and c2.max_bytes == 2.e8
+    assert len(iqloc.process_caches) == 1
@@ -0,0 +1,28 @@
+import os
+from glseis.iqloc import icequake_locations
+
+
+def locations(path, jday):
+    iq = icequake_locations.__new__(icequake_locations)
+    iq.path2mseed, iq.chn, iq.jday = str(path) + "/", "GP1", jday
+    return iq
+
+
+def touch(path, name):
+    os.makedirs(os.path.join(path, "PM15", "GP1.D"), exist_ok=True)
+    open(os.path.join(path, "PM15", "GP1.D", name), "w").close()
+
+
+def test_unpadded_and_padded_day(tmp_path):
+    # unpadded julian day (original naming)
+    touch(tmp_path / "a", "4D.PM15..GP1.D.2016.5")
+    fn = icequake_locations.station_day_file(locations(tmp_path / "a", 5), "PM15")
+    assert fn.endswith("4D.PM15..GP1.D.2016.5") and os.path.isfile(fn)
+    # zero padded julian day
+    touch(tmp_path / "b", "4D.PM15..GP1.D.2016.005")
+    fn = icequake_locations.station_day_file(locations(tmp_path / "b", 5), "PM15")
+    assert fn.endswith("4D.PM15..GP1.D.2016.005") and os.path.isfile(fn)
+    # both forms agree for julian days >= 100
+    touch(tmp_path / "a", "4D.PM15..GP1.D.2016.123")
+    fn = icequake_locations.station_day_file(locations(tmp_path / "a", 123), "PM15")
+    assert fn.endswith("4D.PM15..GP1.D.2016.123") and os.path.isfile(fn)
@@ -0,0 +1,38 @@
+import warnings
+import numpy as np
+import pytest
+from glseis import array_analysis
+from glseis.array_analysis import sxsy_beam, sxsy_grid
+
+
+def problem():
+    rng = np.random.default_rng(1)
+    scoord = rng.uniform(-300, 300, (30, 2))
+    v = np.exp(1j * rng.uniform(0, 2 * np.pi, 30))
+    K = np.outer(v, v.conj()) / 30.
+    sx = sxsy_grid(1., 0.006)
+    # large enough for the non-uniform FFT
+    assert scoord.shape[0]**2 * sx.size**2 > 1.e8
+    return K, scoord, sx
+
+
+def test_fallback_warns(monkeypatch):
+    K, scoord, sx = problem()
+    monkeypatch.setattr(array_analysis, "finufft", None)
+    with pytest.warns(UserWarning, match="finufft is not installed"):
+        sxsy_beam(K, scoord, 7., sx, sx)
+    # no warning for small problems
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")
+        sxsy_beam(K, scoord, 7., sx[::4], sx[::4])
+
+
+def test_nufft_equals_fallback(monkeypatch):
+    pytest.importorskip("finufft")
+    K, scoord, sx = problem()
+    beam = sxsy_beam(K, scoord, 7., sx, sx)
+    monkeypatch.setattr(array_analysis, "finufft", None)
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        beam_ = sxsy_beam(K, scoord, 7., sx, sx)
+    np.testing.assert_allclose(beam, beam_, atol=1.e-7)